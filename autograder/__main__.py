@@ -1,5 +1,60 @@
-from autograder import autograder
+import argparse
+import pathlib
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m autograder",
+                                     description="Grades every fork in resources/mapping.yaml against the base repo's "
+                                                 "testcases and emails the reports. Configured through AUTOGRADER_* "
+                                                 "environment variables or ~/.autograder.env.")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    coordinator_parser = subparsers.add_parser("coordinator",
+                                               help="hand out forks to workers, merge their reports and email them")
+    coordinator_parser.add_argument("--listen", default="0.0.0.0:6310", metavar="HOST:PORT")
+    worker_parser = subparsers.add_parser("worker", help="grade forks handed out by a coordinator")
+    worker_parser.add_argument("--connect", required=True, metavar="HOST:PORT")
+    worker_parser.add_argument("--slots", type=int, help="forks graded at once (default: AUTOGRADER_WORKER_SLOTS)")
+    results_parser = subparsers.add_parser("results", help="query the results database of earlier runs")
+    queries = results_parser.add_subparsers(dest="query", metavar="query", required=True)
+    queries.add_parser("runs", help="list the runs in the database")
+    pass_rates_parser = queries.add_parser("pass-rates", help="share of tests passed per assignment")
+    pass_rates_parser.add_argument("--run", help="run id (default: the latest run)")
+    regressions_parser = queries.add_parser("regressions", help="tests that passed in one run and not in a later one")
+    regressions_parser.add_argument("--run", help="run id (default: the latest run)")
+    regressions_parser.add_argument("--old-run", help="run id to compare with (default: the run before --run)")
+    flaky_parser = queries.add_parser("flaky", help="tests that passed and failed on the same commit of a fork")
+    flaky_parser.add_argument("--min-runs", type=int, default=2, help="runs of a commit needed (default: 2)")
+    export_parser = queries.add_parser("export-csv", help="print a run's results in the csv report format")
+    export_parser.add_argument("--run", help="run id (default: the latest run)")
+    export_parser.add_argument("--deadline", metavar="YYYY-MM-DD",
+                               help="only this deadline of runs that graded several (default: all of them)")
+    emergency_parser = subparsers.add_parser("emergency",
+                                             help="grade the repos already cloned in the working dir without gitlab, "
+                                                  "writing a report file per team instead of emailing")
+    emergency_parser.add_argument("--assignment", action="append", dest="assignments", metavar="NAME",
+                                  help="only grade this assignment, may be repeated (default: all of them)")
+    emergency_parser.add_argument("--reports-dir", metavar="DIR",
+                                  help="where <team>.txt is written (default: emergency_reports in the working dir)")
+    args = parser.parse_args()
+
+    # imported here so that --help doesn't pay for loading the whole grading pipeline
+    if args.command == "coordinator":
+        from autograder import distributed
+        distributed.Coordinator(distributed.parse_address(args.listen)).main()
+    elif args.command == "worker":
+        from autograder import cfg, distributed
+        distributed.Worker(distributed.parse_address(args.connect), args.slots or cfg.AUTOGRADER_WORKER_SLOTS).main()
+    elif args.command == "results":
+        from autograder.project import results_db
+        results_db.query(args)
+    elif args.command == "emergency":
+        from autograder import cfg, emergency
+        reports_path = pathlib.Path(args.reports_dir or pathlib.Path(cfg.AUTOGRADER_WORKING_DIR, "emergency_reports"))
+        emergency.Emergency(reports_path, args.assignments).main()
+    else:
+        from autograder import autograder
+        autograder.Autograder().main()
+
 
 if __name__ == "__main__":
-    autograder = autograder.Autograder()
-    autograder.main()
+    main()
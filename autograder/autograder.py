@@ -1,39 +1,105 @@
 import logging
 import logging.handlers
+import math
 import os
 import pathlib
-import shutil
 import subprocess
+import time
 from datetime import datetime
 from multiprocessing.pool import ThreadPool
 
 import pytz
 
-from autograder import cfg
-from autograder.project import reporter, test_runner
+from autograder import cfg, git_mirror, mailer, timing
+from autograder.project import (build_cache, compiler_cache, output_cache, reporter, result_store, results_db,
+                                scheduler, test_runner, test_suite)
+
+
+def deadline_timestamp(deadline=None) -> int:
+    # the start of the deadline day in montreal
+    if deadline is None:
+        deadline = cfg.AUTOGRADER_DEADLINE_VAL
+    deadline_naive = datetime.combine(deadline, datetime.min.time())
+    deadline_mtl = pytz.timezone('America/Toronto').localize(deadline_naive)
+    return int(deadline_mtl.timestamp())
+
+
+def prioritize(forks: list) -> list:
+    # longest expected grading time first, so no slow fork starts last while the other threads sit idle. forks
+    # never graded before go first. close to the deadline, forks whose commit changed in their last run come
+    # before the others, their teams are the ones waiting for a report
+    history = results_db.fork_history()
+    prioritize_active = False
+    if cfg.AUTOGRADER_PRIORITIZE_ACTIVE_HOURS > 0 and not cfg.AUTOGRADER_DISABLE_DEADLINE:
+        hours_left = (deadline_timestamp() - time.time()) / 3600
+        prioritize_active = 0 <= hours_left <= cfg.AUTOGRADER_PRIORITIZE_ACTIVE_HOURS
+
+    def priority(fork):
+        expected_duration, active = history.get(fork, (math.inf, False))
+        return not (prioritize_active and active), -expected_duration
+
+    return sorted(forks, key=priority)
 
 
 class Autograder:
     _gitlab = None
     _gitlab_token = None
     _gitlab_autograder_user_id = None
+    _base_commit_id = None
+    _test_suite = None
+    _deadlines = (None,)
 
     def main(self):
         self.set_up_logging()
-        # clone the prof's repo to use tests from it
-        self.update_local_repo(cfg.AUTOGRADER_BASE_REPO_CLONE_LOCATION, cfg.AUTOGRADER_BASE_REPO,
-                               cfg.AUTOGRADER_BASE_REPO_BRANCH, True)
-        if cfg.AUTOGRADER_TARGET_ONLY:
-            forks = [cfg.AUTOGRADER_TARGET_ONLY]
-        else:
-            forks = cfg.FORKS.keys()
+        timing.start(cfg.AUTOGRADER_WORKING_DIR, cfg.AUTOGRADER_RUN_ID)
+        mailer.start()
+        self.prepare()
+        forks = self.forks()
         logging.info(f"Found {len(forks)} forks of main project, starting autograding...")
 
-        with ThreadPool() as p:
-            p.map(self.process_project, forks)
+        # one fork at a time per thread, so a thread that finishes early takes the next fork in line
+        with ThreadPool(cfg.AUTOGRADER_FORK_WORKERS) as p:
+            for _ in p.imap_unordered(self.process_project, forks, chunksize=1):
+                pass
             logging.info("Autograder completed.")
-
-        cfg.AUTOGRADER_CSV_REPORT_FILE.close()
+        scheduler.shutdown()
+        mailer.stop()
+
+        results_db.write_csv_reports()
+        results_db.close()
+        timing.log_summary()
+        compiler_cache.log_stats()
+        output_cache.log_stats()
+        timing.stop()
+
+    def prepare(self):
+        # everything needed before the first fork can be graded
+        build_cache.prune(cfg.AUTOGRADER_BUILD_CACHE_MAX_AGE_DAYS)
+        result_store.prune(cfg.AUTOGRADER_RESULTS_MAX_AGE_DAYS)
+        compiler_cache.start()
+        # clone the prof's repo to use tests from it
+        with timing.phase("clone", cfg.AUTOGRADER_BASE_REPO):
+            self._base_commit_id = self.update_local_repo(cfg.AUTOGRADER_BASE_REPO_CLONE_LOCATION,
+                                                          cfg.AUTOGRADER_BASE_REPO,
+                                                          cfg.AUTOGRADER_BASE_REPO_BRANCH, True).strip()
+        self._test_suite = test_runner.calibrate_timeouts(test_suite.load(cfg.AUTOGRADER_BASE_REPO_CLONE_PATH),
+                                                          cfg.AUTOGRADER_BASE_REPO_CLONE_PATH, self._base_commit_id)
+        self._deadlines = self.deadlines()
+
+    def deadlines(self) -> list:
+        # the first one is the deadline of the emailed report. None grades what update_local_repo picks without
+        # a deadline
+        if cfg.AUTOGRADER_DISABLE_DEADLINE or cfg.AUTOGRADER_SPECIFIC_COMMIT or cfg.AUTOGRADER_USE_LOCAL_COPY:
+            if cfg.AUTOGRADER_EXTRA_DEADLINES:
+                logging.warning("Ignoring AUTOGRADER_EXTRA_DEADLINES, this run doesn't grade the last commit "
+                                "before a deadline")
+            return [None]
+        return [cfg.AUTOGRADER_DEADLINE_VAL, *cfg.AUTOGRADER_EXTRA_DEADLINES]
+
+    def forks(self) -> list:
+        if cfg.AUTOGRADER_TARGET_ONLY:
+            return [cfg.AUTOGRADER_TARGET_ONLY]
+        return prioritize(list(cfg.FORKS.keys()))
 
     def set_up_logging(self):
         urllib3_logger = logging.getLogger("urllib3")
@@ -53,92 +119,122 @@ class Autograder:
                             handlers=handler_list)
 
     def process_project(self, project):
+        # the other forks keep being graded if one of them fails
+        try:
+            with timing.phase("fork", project):
+                start = time.perf_counter()
+                reports = self.grade_deadlines(project)
+                results_db.record(project, reports, time.perf_counter() - start)
+                with timing.phase("email"):
+                    reports[0].send_email()
+                for rep in reports[1:]:
+                    rep.discard()
+        except Exception:
+            logging.exception(f"Grading {project} failed")
+
+    def grade_deadlines(self, project) -> list:
+        # one report per deadline, only the first one keeps the outputs to email. the fork is fetched once and a
+        # commit that is the last one before several deadlines is graded once
+        graded = {} if len(self._deadlines) > 1 else None
+        return [self.grade_project(project, deadline, keep_outputs=i == 0, fetch=i == 0, graded=graded)
+                for i, deadline in enumerate(self._deadlines)]
+
+    def grade_project(self, project, deadline=None, keep_outputs=True, fetch=True, graded=None) -> reporter.Reporter:
+        # graded maps the commits already graded for other deadlines to their snapshot
         logging.debug(f"Beggining processing for '{project}'")
-        rep = reporter.Reporter(project)
+        rep = reporter.Reporter(project, results_db.deadline_key(deadline), keep_outputs)
 
         clone_location = f"{cfg.AUTOGRADER_WORKING_DIR}/repos/{project}"
         could_clone = False
         try:
-            last_commit_id = self.update_local_repo(clone_location, project)
+            with timing.phase("clone"):
+                last_commit_id = self.update_local_repo(clone_location, project, deadline=deadline, fetch=fetch)
             rep.append(f"As of commit {last_commit_id}")
+            commit_id = last_commit_id.strip()
+            rep.commit_id = commit_id
             could_clone = True
         except Exception:
             rep.append("The autograder couldn't clone your repo. Did you add @jrolon with Reporter access?")
             logging.error(f"Error cloning {project} into {clone_location}, stopping processing")
 
+        if could_clone and graded is not None and commit_id in graded:
+            logging.debug(f"{project} is at the same commit for deadline {rep.deadline}, reusing its grade")
+            rep.replay(graded[commit_id])
+            return rep
+
+        # local copies may carry uncommitted changes, so the commit id does not identify what gets graded
+        result_key = None
+        if could_clone and not cfg.AUTOGRADER_USE_LOCAL_COPY:
+            result_key = result_store.key(commit_id, self._base_commit_id)
+            stored_result = None
+            if not cfg.AUTOGRADER_FORCE_REGRADE:
+                stored_result = result_store.load(result_key)
+            if stored_result:
+                logging.info(f"No changes for {project} since it was last graded, reusing stored result")
+                rep.replay(stored_result)
+                return rep
+
         if could_clone:
             src_location = f"{clone_location}/src"
             if not os.path.isdir(src_location):
                 rep.append("Expected repository structure not found. Did you fork the coursework repo?")
             else:
-                # some students are committing their binaries, we need to run make clean first
+                compilation_pass = False
                 try:
-                    subprocess.run(["make", "clean"], timeout=1, cwd=src_location, capture_output=cfg.CAPTURE_OUTPUT)
-                except subprocess.SubprocessError:
+                    with timing.phase("compile"):
+                        build_cache.build(src_location, commit_id, timeout=cfg.AUTOGRADER_COMPILE_TIMEOUT,
+                                          clean_must_succeed=False)
+                    compilation_pass = True
+                except build_cache.BuildTimeout:
+                    rep.timed_out = True
+                except build_cache.BuildError:
                     pass
 
-                compilation_pass = False
-                completed_make = subprocess.run(cfg.autograder_make_command_line(), cwd=src_location,
-                                                timeout=5,
-                                                capture_output=cfg.CAPTURE_OUTPUT)
-                # make might have exited correctly, but mysh might not be there
-                if completed_make.returncode == 0:
-                    if os.path.isfile(f"{src_location}/mysh"):
-                        compilation_pass = True
-                        rep.append("# Compilation PASS")
-                        test_runner.TestRunner(project, pathlib.Path(clone_location)).run_all()
-
-                if not compilation_pass:
+                if compilation_pass:
+                    rep.append("# Compilation PASS")
+                    test_runner.TestRunner(project, pathlib.Path(clone_location), commit_id,
+                                           self._test_suite).run_all()
+                else:
                     rep.append("# Compilation FAILED")
 
-        rep.send_email()
-
-    def update_local_repo(self, clone_location: str, project, branch_to_clone=cfg.AUTOGRADER_CLONE_BRANCH, disable_deadline=cfg.AUTOGRADER_DISABLE_DEADLINE):
+            # a report without outputs would be replayed into emails without attachments. a timeout is graded
+            # again next run
+            if result_key and rep.keep_outputs and not rep.timed_out:
+                result_store.save(result_key, rep.snapshot())
+            if graded is not None:
+                graded[commit_id] = rep.snapshot()
+
+        return rep
+
+    def update_local_repo(self, clone_location: str, project, branch_to_clone=None, disable_deadline=None,
+                          deadline=None, fetch=True):
+        if branch_to_clone is None:
+            branch_to_clone = cfg.AUTOGRADER_CLONE_BRANCH
+        if disable_deadline is None:
+            disable_deadline = cfg.AUTOGRADER_DISABLE_DEADLINE
         if cfg.AUTOGRADER_USE_LOCAL_COPY:
             last_commit_id = subprocess.check_output(["git", "rev-parse", "HEAD"],
                                                      cwd=clone_location,
                                                      encoding='utf-8')
         else:
-            if os.path.isdir(clone_location):
-                # apparently some students' code creates directories without read access, so we ensure rwx permissions
-                completed_chown = subprocess.run(["chmod", "-R", "744", clone_location], capture_output=cfg.CAPTURE_OUTPUT)
-                if completed_chown.returncode != 0:
-                    logging.warning(f"Could not change dir permissions on {clone_location}, clone may fail")
-                shutil.rmtree(clone_location)
-
-            clone_result = subprocess.run(
-                ["git", "clone", f"--branch={branch_to_clone}", "--single-branch",
-                 f"https://oauth2:{cfg.AUTOGRADER_GITLAB_TOKEN}@{cfg.GITLAB_URL}/{project}.git", clone_location],
-                capture_output=cfg.CAPTURE_OUTPUT, text=True)
-            if clone_result.returncode != 0:
-                if clone_result.stderr:
-                    logging.error(f"{clone_result.stderr}")
-                raise Exception(f"Git clone failed with status code {clone_result.returncode}")
+            mirror_location = pathlib.Path(cfg.AUTOGRADER_MIRRORS_PATH, f"{project}.git")
+            if fetch:
+                with scheduler.stage("fetch"):
+                    fetched = git_mirror.update_mirror(mirror_location, cfg.autograder_remote_url(project),
+                                                       branch_to_clone)
+                if fetched:
+                    logging.debug(f"Fetched new commits for {project}")
 
             if disable_deadline:
-                last_commit_id = subprocess.check_output(["git", "rev-parse", "HEAD"],
-                    cwd=clone_location,
-                    encoding='utf-8')
+                last_commit_id = git_mirror.resolve(mirror_location, git_mirror.branch_ref(branch_to_clone))
             else:
                 if cfg.AUTOGRADER_SPECIFIC_COMMIT:
                     last_commit_id = cfg.AUTOGRADER_SPECIFIC_COMMIT
                 else:
                     # obtain last commit id before deadline
-                    deadline_naive = datetime.combine(cfg.AUTOGRADER_DEADLINE_VAL, datetime.min.time())
-                    deadline_mtl = pytz.timezone('America/Toronto').localize(deadline_naive)
-                    deadline_mtl_unix = int(deadline_mtl.timestamp())
-                    last_commit_id_output = subprocess.check_output([
-                        "git", "log", f"--before={deadline_mtl_unix}", "--pretty=format:'%H'"],
-                        cwd=clone_location,
-                        encoding='utf-8')
-                    last_commit_id = last_commit_id_output.replace("'", "").splitlines()[0]
-
-                # checkout to that commit
-                checkout_result = subprocess.run(
-                    ["git", "checkout", last_commit_id],
-                    cwd=clone_location,
-                    capture_output=cfg.CAPTURE_OUTPUT)
-                if checkout_result.returncode != 0:
-                    raise Exception(f"Git checkout failed with status code {clone_result.returncode}")
+                    last_commit_id = git_mirror.last_commit_before(mirror_location, branch_to_clone,
+                                                                   deadline_timestamp(deadline))
+
+            git_mirror.checkout(mirror_location, pathlib.Path(clone_location), last_commit_id)
 
         return last_commit_id
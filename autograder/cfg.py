@@ -1,69 +1,243 @@
 import datetime
+import functools
 import os
 import pathlib
-
-import dateparser
-import dotenv
-import yaml
+import threading
 
 from env_flag import env_flag
 
-# load from env file
-autograder_env_path = pathlib.Path.home() / ".autograder.env"
-if autograder_env_path.exists():
-    dotenv.load_dotenv(dotenv_path=autograder_env_path)
-
-# define exports
-MJ_USERNAME = os.getenv("MJ_USERNAME")
-MJ_PASSWORD = os.getenv("MJ_PASSWORD")
+# nothing is read when this module is imported, the configuration is built on first use (or by load()) and
+# expensive values (yaml files, deadline parsing) only when something asks for them.
+# every setting is read as an attribute of this module, e.g. cfg.FORKS
+
+
+class Config:
+    def __init__(self, **overrides):
+        # load from env file
+        autograder_env_path = pathlib.Path.home() / ".autograder.env"
+        if autograder_env_path.exists():
+            import dotenv
+            dotenv.load_dotenv(dotenv_path=autograder_env_path)
+
+        self.MJ_USERNAME = os.getenv("MJ_USERNAME")
+        self.MJ_PASSWORD = os.getenv("MJ_PASSWORD")
+        self.MJ_API_URL = os.getenv("MJ_API_URL")
+
+        self.AUTOGRADER_WORKING_DIR = os.getenv("AUTOGRADER_WORKING_DIR", default=str(pathlib.Path.home()))
+        self.AUTOGRADER_TARGET_ONLY = os.getenv("AUTOGRADER_TARGET_ONLY")
+        self.AUTOGRADER_LOG_MAX_FILES = os.getenv("AUTOGRADER_LOG_MAX_FILES", 7)
+        self.AUTOGRADER_GITLAB_TOKEN = os.getenv("AUTOGRADER_GITLAB_TOKEN")
+        self.AUTOGRADER_CLONE_BRANCH = os.getenv("AUTOGRADER_CLONE_BRANCH", "main")
+
+        self.AUTOGRADER_DISABLE_DEADLINE = env_flag("AUTOGRADER_DISABLE_DEADLINE")
+
+        self.AUTOGRADER_BASE_REPO = os.getenv("AUTOGRADER_GITLAB_BASE_REPO", default="balmau/comp310-winter23")
+        self.AUTOGRADER_BASE_REPO_BRANCH = os.getenv("AUTOGRADER_BASE_REPO_BRANCH", default="main")
+        self.AUTOGRADER_SPECIFIC_COMMIT = os.getenv("AUTOGRADER_SPECIFIC_COMMIT")
+
+        self.AUTOGRADER_USE_LOCAL_COPY = env_flag("AUTOGRADER_USE_LOCAL_COPY")
+
+        self.DEBUG = env_flag("DEBUG")
+        self.CAPTURE_OUTPUT = env_flag("CAPTURE_OUTPUT")
+        if not self.CAPTURE_OUTPUT:
+            self.CAPTURE_OUTPUT = not self.DEBUG
+
+        self.GITLAB_URL = os.getenv("AUTOGRADER_GITLAB_URL", "gitlab.cs.mcgill.ca")
+        # e.g. file:///srv/forks to fetch from local repos instead of gitlab
+        self.AUTOGRADER_GIT_REMOTE = os.getenv("AUTOGRADER_GIT_REMOTE")
+
+        self.AUTOGRADER_MT_ITERATIONS = int(os.getenv("AUTOGRADER_MT_ITERATIONS", default=10))
+        # output beyond this is dropped and the program is stopped
+        self.AUTOGRADER_MAX_OUTPUT_BYTES = int(os.getenv("AUTOGRADER_MAX_OUTPUT_BYTES", default=1024 * 1024))
+        # total size of the outputs attached to one email, mailjet rejects messages over 15MB
+        self.AUTOGRADER_MAX_ATTACHMENT_BYTES = int(os.getenv("AUTOGRADER_MAX_ATTACHMENT_BYTES",
+                                                             default=5 * 1024 * 1024))
+        self.AUTOGRADER_MAIL_BATCH_SIZE = int(os.getenv("AUTOGRADER_MAIL_BATCH_SIZE", default=50))
+        # base64 attachments in one request, a message bigger than this is sent on its own
+        self.AUTOGRADER_MAIL_BATCH_MAX_BYTES = int(os.getenv("AUTOGRADER_MAIL_BATCH_MAX_BYTES",
+                                                             default=20 * 1024 * 1024))
+        self.AUTOGRADER_MAIL_BATCH_DELAY = float(os.getenv("AUTOGRADER_MAIL_BATCH_DELAY", default=5))
+        self.AUTOGRADER_MAIL_RETRIES = int(os.getenv("AUTOGRADER_MAIL_RETRIES", default=5))
+        self.AUTOGRADER_MAIL_RETRY_BACKOFF = float(os.getenv("AUTOGRADER_MAIL_RETRY_BACKOFF", default=2))
+
+        self.AUTOGRADER_TEST_WORKERS = int(os.getenv("AUTOGRADER_TEST_WORKERS", default=os.cpu_count()))
+        # forks in progress at once. most of them wait on fetches or on their tests, the stages below and the
+        # test workers are what bound the actual work
+        self.AUTOGRADER_FORK_WORKERS = int(os.getenv("AUTOGRADER_FORK_WORKERS", default=32))
+        self.AUTOGRADER_FETCH_WORKERS = int(os.getenv("AUTOGRADER_FETCH_WORKERS", default=16))
+        self.AUTOGRADER_BUILD_WORKERS = int(os.getenv("AUTOGRADER_BUILD_WORKERS", default=os.cpu_count()))
+        # seconds. the compile check runs once per fork, builds for the tests may use other memory sizes
+        self.AUTOGRADER_COMPILE_TIMEOUT = float(os.getenv("AUTOGRADER_COMPILE_TIMEOUT", default=5))
+        self.AUTOGRADER_BUILD_TIMEOUT = float(os.getenv("AUTOGRADER_BUILD_TIMEOUT", default=15))
+        # a test may run for its reference runtime on the base repo times the multiplier, within min and max.
+        # tests the base repo doesn't pass get the max
+        self.AUTOGRADER_RUN_TIMEOUT_MULTIPLIER = float(os.getenv("AUTOGRADER_RUN_TIMEOUT_MULTIPLIER", default=10))
+        self.AUTOGRADER_MIN_RUN_TIMEOUT = float(os.getenv("AUTOGRADER_MIN_RUN_TIMEOUT", default=3))
+        self.AUTOGRADER_MAX_RUN_TIMEOUT = float(os.getenv("AUTOGRADER_MAX_RUN_TIMEOUT", default=15))
+        # after this many tests in a row time out or crash, the rest of the assignment is skipped. 0 disables it
+        self.AUTOGRADER_FAIL_FAST_AFTER = int(os.getenv("AUTOGRADER_FAIL_FAST_AFTER", default=3))
+        # limits for every run of a student binary
+        self.AUTOGRADER_DISABLE_SANDBOX = env_flag("AUTOGRADER_DISABLE_SANDBOX")
+        self.AUTOGRADER_TEST_MEMORY_MB = int(os.getenv("AUTOGRADER_TEST_MEMORY_MB", default=512))
+        self.AUTOGRADER_TEST_MAX_PIDS = int(os.getenv("AUTOGRADER_TEST_MAX_PIDS", default=64))
+        self.AUTOGRADER_TEST_MAX_FILE_MB = int(os.getenv("AUTOGRADER_TEST_MAX_FILE_MB", default=64))
+        # a cgroup v2 directory delegated to the autograder, with the cpu, memory and pids controllers enabled
+        # in its cgroup.subtree_control
+        self.AUTOGRADER_CGROUP_PATH = os.getenv("AUTOGRADER_CGROUP_PATH")
+
+        self.AUTOGRADER_BUILD_CACHE_MAX_AGE_DAYS = int(os.getenv("AUTOGRADER_BUILD_CACHE_MAX_AGE_DAYS", default=14))
+        # stored results not replayed for this long are removed
+        self.AUTOGRADER_RESULTS_MAX_AGE_DAYS = int(os.getenv("AUTOGRADER_RESULTS_MAX_AGE_DAYS", default=14))
+        self.AUTOGRADER_DISABLE_BUILD_CACHE = env_flag("AUTOGRADER_DISABLE_BUILD_CACHE")
+        # ccache, see compiler_cache.py
+        self.AUTOGRADER_DISABLE_COMPILER_CACHE = env_flag("AUTOGRADER_DISABLE_COMPILER_CACHE")
+        self.AUTOGRADER_COMPILER_CACHE_MAX_MB = int(os.getenv("AUTOGRADER_COMPILER_CACHE_MAX_MB", default=2048))
+
+        # distinct outputs whose score is kept for the other forks printing the same, see output_cache.py. 0
+        # disables it
+        self.AUTOGRADER_OUTPUT_CACHE_SIZE = int(os.getenv("AUTOGRADER_OUTPUT_CACHE_SIZE", default=4096))
+
+        self.AUTOGRADER_FORCE_REGRADE = env_flag("AUTOGRADER_FORCE_REGRADE")
+        # within this many hours of the deadline, forks whose commit changed in their last run are graded first.
+        # 0 disables it
+        self.AUTOGRADER_PRIORITIZE_ACTIVE_HOURS = float(os.getenv("AUTOGRADER_PRIORITIZE_ACTIVE_HOURS", default=0))
+
+        # grading across several hosts, see distributed.py
+        self.AUTOGRADER_CLUSTER_AUTHKEY = os.getenv("AUTOGRADER_CLUSTER_AUTHKEY")
+        self.AUTOGRADER_WORKER_SLOTS = int(os.getenv("AUTOGRADER_WORKER_SLOTS", default=os.cpu_count()))
+        # a fork not graded within its lease is handed to another worker, at most this many times in total
+        self.AUTOGRADER_LEASE_SECONDS = float(os.getenv("AUTOGRADER_LEASE_SECONDS", default=30 * 60))
+        self.AUTOGRADER_MAX_ATTEMPTS = int(os.getenv("AUTOGRADER_MAX_ATTEMPTS", default=3))
+        self.AUTOGRADER_CONNECT_TIMEOUT = float(os.getenv("AUTOGRADER_CONNECT_TIMEOUT", default=60))
+
+        self.started_at = datetime.datetime.now()
+
+        # applied before any of the values below are derived, so e.g. overriding the working dir moves them all
+        for name, value in overrides.items():
+            setattr(self, name, value)
+
+    @functools.cached_property
+    def AUTOGRADER_DEADLINE_VAL(self):
+        deadline_val = os.getenv("AUTOGRADER_DEADLINE_VAL")
+        if deadline_val:
+            import dateparser  # slow to import, only needed when a deadline is given
+            return dateparser.parse(deadline_val)
+        return datetime.date.today()
+
+    @functools.cached_property
+    def AUTOGRADER_EXTRA_DEADLINES(self):
+        # comma separated, e.g. 2023-02-11,2023-02-12 for late penalty cutoffs graded in the same run. only
+        # AUTOGRADER_DEADLINE_VAL gets emailed
+        extra_deadlines = os.getenv("AUTOGRADER_EXTRA_DEADLINES")
+        if not extra_deadlines:
+            return []
+        import dateparser
+        return [dateparser.parse(deadline_val) for deadline_val in extra_deadlines.split(",")]
+
+    @functools.cached_property
+    def AUTOGRADER_RUN_ID(self):
+        return self.started_at.strftime('%Y%m%d%H%M%S')
+
+    @functools.cached_property
+    def AUTOGRADER_BASE_REPO_CLONE_LOCATION(self):
+        return f"{self.AUTOGRADER_WORKING_DIR}/repos/{self.AUTOGRADER_BASE_REPO}"
+
+    @functools.cached_property
+    def AUTOGRADER_BASE_REPO_CLONE_PATH(self):
+        return pathlib.Path(self.AUTOGRADER_BASE_REPO_CLONE_LOCATION)
+
+    @functools.cached_property
+    def AUTOGRADER_REPORT_PATH(self):
+        return pathlib.Path(f"{self.AUTOGRADER_WORKING_DIR}/reports/")
+
+    @functools.cached_property
+    def AUTOGRADER_TEST_OUTPUTS_PATH(self):
+        return pathlib.Path(f"{self.AUTOGRADER_WORKING_DIR}/test_outputs/{self.AUTOGRADER_RUN_ID}")
+
+    @functools.cached_property
+    def AUTOGRADER_MIRRORS_PATH(self):
+        return pathlib.Path(f"{self.AUTOGRADER_WORKING_DIR}/mirrors")
+
+    @functools.cached_property
+    def AUTOGRADER_OUTBOX_PATH(self):
+        return pathlib.Path(f"{self.AUTOGRADER_WORKING_DIR}/outbox")
+
+    @functools.cached_property
+    def AUTOGRADER_BUILD_CACHE_PATH(self):
+        return pathlib.Path(os.getenv("AUTOGRADER_BUILD_CACHE_PATH",
+                                      default=f"{self.AUTOGRADER_WORKING_DIR}/build_cache"))
+
+    @functools.cached_property
+    def AUTOGRADER_COMPILER_CACHE_PATH(self):
+        return pathlib.Path(os.getenv("AUTOGRADER_COMPILER_CACHE_PATH",
+                                      default=f"{self.AUTOGRADER_WORKING_DIR}/ccache"))
+
+    @functools.cached_property
+    def AUTOGRADER_RESULTS_PATH(self):
+        return pathlib.Path(f"{self.AUTOGRADER_WORKING_DIR}/results")
+
+    @functools.cached_property
+    def AUTOGRADER_RESULTS_DB_PATH(self):
+        return pathlib.Path(os.getenv("AUTOGRADER_RESULTS_DB_PATH",
+                                      default=f"{self.AUTOGRADER_WORKING_DIR}/results.sqlite3"))
+
+    @functools.cached_property
+    def FORKS(self):
+        return _load_resource("mapping.yaml")
+
+    @functools.cached_property
+    def ORDER_MATTERS(self):
+        return _load_resource("order_matters.yml")
+
+    @functools.cached_property
+    def RUN_MULTIPLE(self):
+        return _load_resource("run_multiple.yml")
 
-AUTOGRADER_WORKING_DIR = os.getenv("AUTOGRADER_WORKING_DIR", default=str(pathlib.Path.home()))
-AUTOGRADER_TARGET_ONLY = os.getenv("AUTOGRADER_TARGET_ONLY")
-AUTOGRADER_LOG_MAX_FILES = os.getenv("AUTOGRADER_LOG_MAX_FILES", 7)
-AUTOGRADER_GITLAB_TOKEN = os.getenv("AUTOGRADER_GITLAB_TOKEN")
-AUTOGRADER_CLONE_BRANCH = os.getenv("AUTOGRADER_CLONE_BRANCH", "main")
 
-AUTOGRADER_DISABLE_DEADLINE = env_flag("AUTOGRADER_DISABLE_DEADLINE")
-deadline_val = os.getenv("AUTOGRADER_DEADLINE_VAL")
-if deadline_val:
-    AUTOGRADER_DEADLINE_VAL = dateparser.parse(deadline_val)
-else:
-    AUTOGRADER_DEADLINE_VAL = datetime.date.today()
+def _load_resource(file_name: str):
+    import yaml
+    with open(f"{os.path.dirname(__file__)}/resources/{file_name}", "r") as f:
+        return yaml.safe_load(f)
+
 
-AUTOGRADER_BASE_REPO = os.getenv("AUTOGRADER_GITLAB_BASE_REPO", default="balmau/comp310-winter23")
-AUTOGRADER_BASE_REPO_CLONE_LOCATION = f"{AUTOGRADER_WORKING_DIR}/repos/{AUTOGRADER_BASE_REPO}"
-AUTOGRADER_BASE_REPO_CLONE_PATH = pathlib.Path(AUTOGRADER_BASE_REPO_CLONE_LOCATION)
-AUTOGRADER_BASE_REPO_BRANCH = os.getenv("AUTOGRADER_BASE_REPO_BRANCH", default="main")
-AUTOGRADER_SPECIFIC_COMMIT = os.getenv("AUTOGRADER_SPECIFIC_COMMIT")
+_config = None
+_config_lock = threading.Lock()
 
-AUTOGRADER_USE_LOCAL_COPY = env_flag("AUTOGRADER_USE_LOCAL_COPY")
 
-AUTOGRADER_REPORT_PATH = pathlib.Path(f"{AUTOGRADER_WORKING_DIR}/reports/")
+def load(**overrides) -> Config:
+    # returns the current configuration, building it on first use or anew when overrides are given
+    global _config
+    with _config_lock:
+        if _config is None or overrides:
+            _config = Config(**overrides)
+        return _config
 
-now = datetime.datetime.now()
-AUTOGRADER_TEST_OUTPUTS_PATH = pathlib.Path(f"{AUTOGRADER_WORKING_DIR}/test_outputs/{now.strftime('%Y%m%d%H%M%S')}")
 
-DEBUG = env_flag("DEBUG")
-CAPTURE_OUTPUT = env_flag("CAPTURE_OUTPUT")
-if not CAPTURE_OUTPUT:
-    CAPTURE_OUTPUT = not DEBUG
+def override(**values):
+    # replaces single values of the current configuration, e.g. cfg.override(FORKS={...})
+    config = load()
+    for name, value in values.items():
+        setattr(config, name, value)
 
-GITLAB_URL = os.getenv("AUTOGRADER_GITLAB_URL", "gitlab.cs.mcgill.ca")
 
-with open(f"{os.path.dirname(__file__)}/resources/mapping.yaml", "r") as f:
-    FORKS = yaml.safe_load(f)
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+    return getattr(load(), name)
 
-with open(f"{os.path.dirname(__file__)}/resources/order_matters.yml", "r") as f:
-    ORDER_MATTERS = yaml.safe_load(f)
 
-with open(f"{os.path.dirname(__file__)}/resources/run_multiple.yml", "r") as f:
-    RUN_MULTIPLE = yaml.safe_load(f)
+def autograder_remote_url(project):
+    config = load()
+    if config.AUTOGRADER_GIT_REMOTE:
+        return f"{config.AUTOGRADER_GIT_REMOTE}/{project}.git"
+    return f"https://oauth2:{config.AUTOGRADER_GITLAB_TOKEN}@{config.GITLAB_URL}/{project}.git"
 
-AUTOGRADER_MT_ITERATIONS = int(os.getenv("AUTOGRADER_MT_ITERATIONS", default=10))
 
-deadline_str = AUTOGRADER_DEADLINE_VAL.strftime("%d%b%Y")
-AUTOGRADER_CSV_REPORT_FILE = open(f"{AUTOGRADER_WORKING_DIR}/report_{deadline_str}.csv", 'w')
+def autograder_csv_report_path(deadline) -> pathlib.Path:
+    return pathlib.Path(load().AUTOGRADER_WORKING_DIR, f"report_{deadline.strftime('%d%b%Y')}.csv")
 
 
-def autograder_make_command_line(frame_sz=18, var_sz=10):
-    return ["make", "CC=gcc-11", f"framesize={frame_sz}", f"varmemsize={var_sz}"]
+def autograder_make_command_line(frame_sz=18, var_sz=10, launcher=None):
+    # launcher, e.g. ccache, runs the compiler
+    compiler = f"{launcher} gcc-11" if launcher else "gcc-11"
+    return ["make", f"CC={compiler}", f"framesize={frame_sz}", f"varmemsize={var_sz}"]
@@ -0,0 +1,260 @@
+import collections
+import logging
+import threading
+import time
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+from autograder import autograder, cfg, mailer, timing
+from autograder.project import compiler_cache, output_cache, reporter, results_db, scheduler
+
+# one coordinator hands out forks, workers on any number of hosts grade them and send back a snapshot of the
+# report (text, results and outputs) for every deadline. the coordinator records those in its results database and
+# sends the emails.
+# messages are pickled, so both ends must share AUTOGRADER_CLUSTER_AUTHKEY
+
+# how long a worker waits before asking again while the remaining forks are being graded elsewhere
+WAIT_INTERVAL = 5
+
+
+def parse_address(address: str):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _authkey() -> bytes:
+    if not cfg.AUTOGRADER_CLUSTER_AUTHKEY:
+        raise RuntimeError("AUTOGRADER_CLUSTER_AUTHKEY must be set to the same secret on the coordinator and "
+                           "the workers")
+    return cfg.AUTOGRADER_CLUSTER_AUTHKEY.encode('utf-8')
+
+
+class JobQueue:
+    def __init__(self, projects):
+        self.pending = collections.deque(projects)
+        self.num_projects = len(self.pending)
+        self.attempts = collections.Counter()
+        # leases on each project that haven't ended yet
+        self.leases = collections.Counter()
+        self.claimed = set()
+        self.done = set()
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not self.pending:
+            self.finished.set()
+
+    def take(self):
+        with self.lock:
+            if not self.pending:
+                return None
+            project = self.pending.popleft()
+            self.attempts[project] += 1
+            self.leases[project] += 1
+            return project
+
+    def claim(self, project) -> bool:
+        # false when the project was already graded, e.g. by a worker whose lease had expired
+        with self.lock:
+            if project in self.claimed:
+                return False
+            self.claimed.add(project)
+            return True
+
+    def complete(self, project):
+        with self.lock:
+            self.done.add(project)
+            self._check_finished()
+
+    def requeue(self, project):
+        # a lease on it ended: its worker went away, failed or ran out of time. a worker that ran out of time may
+        # still deliver, but it may as well have hung or lost its host, so it isn't waited for
+        with self.lock:
+            self.leases[project] -= 1
+            if project in self.claimed or project in self.pending:
+                return
+            if self.attempts[project] < cfg.AUTOGRADER_MAX_ATTEMPTS:
+                self.pending.append(project)
+            elif self.leases[project] == 0:
+                # e.g. a fork that takes down every worker it is given to
+                logging.error(f"Giving up on {project} after {self.attempts[project]} attempts")
+                self.done.add(project)
+                self._check_finished()
+
+    def _check_finished(self):
+        if len(self.done) == self.num_projects:
+            self.finished.set()
+
+
+class Coordinator:
+    def __init__(self, address):
+        self.address = address
+        self.jobs = None
+
+    def main(self):
+        grader = autograder.Autograder()
+        grader.set_up_logging()
+        timing.start(cfg.AUTOGRADER_WORKING_DIR, cfg.AUTOGRADER_RUN_ID)
+        mailer.start()
+        self.jobs = JobQueue(grader.forks())
+        logging.info(f"Handing out {self.jobs.num_projects} forks on {self.address[0]}:{self.address[1]}")
+
+        with Listener(self.address, authkey=_authkey()) as listener:
+            threading.Thread(target=self.accept, args=(listener,), name="accept", daemon=True).start()
+            self.jobs.finished.wait()
+            logging.info("Autograder completed.")
+        mailer.stop()
+
+        results_db.write_csv_reports()
+        results_db.close()
+        timing.log_summary()
+        timing.stop()
+
+    def accept(self, listener: Listener):
+        while not self.jobs.finished.is_set():
+            try:
+                connection = listener.accept()
+            except AuthenticationError:
+                logging.warning("Rejected a worker with the wrong authkey")
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(connection,), name="serve", daemon=True).start()
+
+    def serve(self, connection):
+        # one connection per worker slot, it asks for a job, grades it and sends the result before asking again
+        with connection:
+            try:
+                while True:
+                    connection.recv()
+                    project = self.jobs.take()
+                    if project is None:
+                        if self.jobs.finished.is_set():
+                            connection.send(("done",))
+                            return
+                        connection.send(("wait", WAIT_INTERVAL))
+                        continue
+
+                    connection.send(("job", project))
+                    start = time.perf_counter()
+                    snapshots = self.wait_for_result(connection, project)
+                    if snapshots is None:
+                        return
+                    self.report(project, snapshots, time.perf_counter() - start)
+            except (EOFError, OSError):
+                # the worker went away between jobs, nothing to hand out again
+                pass
+
+    def wait_for_result(self, connection, project):
+        # a lease: the job is handed out again if the worker disconnects, fails or doesn't answer in time. a slow
+        # worker may still deliver, whichever result comes first is used
+        lease_deadline = time.monotonic() + cfg.AUTOGRADER_LEASE_SECONDS
+        try:
+            with timing.phase("fork", project):
+                while not connection.poll(1):
+                    if lease_deadline is not None and time.monotonic() > lease_deadline:
+                        logging.warning(f"Lease on {project} expired, handing it out again")
+                        self.jobs.requeue(project)
+                        lease_deadline = None
+                message = connection.recv()
+        except (EOFError, OSError):
+            # an expired lease has already ended
+            if lease_deadline is not None:
+                logging.warning(f"Lost the worker grading {project}, handing it out again")
+                self.jobs.requeue(project)
+            return None
+
+        if message[0] != "result":
+            if lease_deadline is not None:
+                logging.warning(f"A worker failed to grade {project}, handing it out again")
+                self.jobs.requeue(project)
+            return None
+        return message[2]
+
+    def report(self, project, snapshots: list, duration: float):
+        # (deadline, snapshot) pairs, the first one is emailed
+        if not self.jobs.claim(project):
+            return
+        # a claimed project is never handed out again, it has to be completed whatever happens or the run never ends
+        try:
+            reports = []
+            for i, (deadline, snapshot) in enumerate(snapshots):
+                rep = reporter.Reporter(project, deadline, keep_outputs=i == 0)
+                rep.replay(snapshot)
+                reports.append(rep)
+            results_db.record(project, reports, duration)
+            with timing.phase("email", project):
+                reports[0].send_email()
+            for rep in reports[1:]:
+                rep.discard()
+        except Exception:
+            logging.exception(f"Reporting {project} failed")
+        finally:
+            # only now, the mailer stops once every project is complete
+            self.jobs.complete(project)
+
+
+class Worker:
+    def __init__(self, address, slots: int):
+        self.address = address
+        self.slots = slots
+        self.grader = None
+
+    def main(self):
+        self.grader = autograder.Autograder()
+        self.grader.set_up_logging()
+        timing.start(cfg.AUTOGRADER_WORKING_DIR, cfg.AUTOGRADER_RUN_ID)
+        self.grader.prepare()
+
+        threads = [threading.Thread(target=self.work, name=f"slot-{i}") for i in range(self.slots)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logging.info("Worker completed.")
+        scheduler.shutdown()
+
+        timing.log_summary()
+        compiler_cache.log_stats()
+        output_cache.log_stats()
+        timing.stop()
+
+    def connect(self):
+        # workers may be started before the coordinator
+        give_up_at = time.monotonic() + cfg.AUTOGRADER_CONNECT_TIMEOUT
+        while True:
+            try:
+                return Client(self.address, authkey=_authkey())
+            except ConnectionRefusedError:
+                if time.monotonic() > give_up_at:
+                    logging.error(f"Could not reach the coordinator at {self.address[0]}:{self.address[1]}")
+                    return None
+                time.sleep(1)
+
+    def work(self):
+        connection = self.connect()
+        if connection is None:
+            return
+        with connection:
+            try:
+                while True:
+                    connection.send(("get",))
+                    message = connection.recv()
+                    if message[0] == "done":
+                        return
+                    if message[0] == "wait":
+                        time.sleep(message[1])
+                        continue
+
+                    project = message[1]
+                    try:
+                        with timing.phase("fork", project):
+                            reports = self.grader.grade_deadlines(project)
+                        snapshots = [(rep.deadline, rep.snapshot()) for rep in reports]
+                        for rep in reports:
+                            rep.discard()
+                    except Exception:
+                        logging.exception(f"Grading {project} failed")
+                        connection.send(("failed", project))
+                        continue
+                    connection.send(("result", project, snapshots))
+            except (EOFError, OSError):
+                logging.info("The coordinator closed the connection, stopping")
@@ -0,0 +1,140 @@
+import bisect
+import json
+import logging
+import os
+import pathlib
+import shutil
+import subprocess
+
+from autograder import cfg
+
+# kept in every mirror, see CommitIndex
+COMMIT_INDEX_FILE = "autograder-commit-index.json"
+
+
+class GitError(Exception):
+    pass
+
+
+def _git(*args, cwd=None, check=True) -> subprocess.CompletedProcess:
+    completed = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True)
+    if check and completed.returncode != 0:
+        if completed.stderr:
+            logging.error(completed.stderr.strip())
+        # named after the subcommand, options like --git-dir come before it
+        subcommand = next((arg for arg in args if not arg.startswith("--")), "")
+        raise GitError(f"'git {subcommand}' failed with status code {completed.returncode}")
+    return completed
+
+
+def branch_ref(branch: str) -> str:
+    return f"refs/heads/{branch}"
+
+
+def resolve(mirror_path: pathlib.Path, rev: str):
+    completed = _git(f"--git-dir={mirror_path}", "rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}", check=False)
+    if completed.returncode != 0:
+        return None
+    return completed.stdout.strip()
+
+
+def update_mirror(mirror_path: pathlib.Path, url: str, branch: str) -> bool:
+    # a bare repo per fork that only ever receives the new objects, returns whether the branch moved
+    if not (mirror_path / "HEAD").is_file():
+        mirror_path.mkdir(parents=True, exist_ok=True)
+        _git("init", "--bare", "--quiet", str(mirror_path))
+
+    previous_head = resolve(mirror_path, branch_ref(branch))
+    _git(f"--git-dir={mirror_path}", "fetch", "--quiet", "--force", "--no-tags", url,
+         f"+{branch_ref(branch)}:{branch_ref(branch)}")
+    return resolve(mirror_path, branch_ref(branch)) != previous_head
+
+
+class CommitIndex:
+    # every commit on a branch by committer date, oldest first, so the last commit before any deadline is one
+    # bisect. stored in the mirror and extended with the commits each fetch brings
+
+    def __init__(self, head=None, commits=()):
+        self.head = head
+        # [committer timestamp, commit id] pairs
+        self.commits = list(commits)
+        self.timestamps = [timestamp for timestamp, _ in self.commits]
+
+    def last_before(self, unix_timestamp: int):
+        i = bisect.bisect_right(self.timestamps, unix_timestamp)
+        return self.commits[i - 1][1] if i else None
+
+
+def _log_commits(mirror_path: pathlib.Path, revision_range: str) -> list:
+    # newest first, like git log
+    log_output = _git(f"--git-dir={mirror_path}", "log", "--pretty=format:%ct %H", revision_range).stdout
+    commits = []
+    for line in log_output.splitlines():
+        timestamp, commit_id = line.split()
+        commits.append([int(timestamp), commit_id])
+    return commits
+
+
+def commit_index(mirror_path: pathlib.Path, branch: str) -> CommitIndex:
+    index_path = mirror_path / COMMIT_INDEX_FILE
+    indexes = {}
+    try:
+        indexes = json.loads(index_path.read_text())
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError):
+        logging.warning(f"Rebuilding unreadable commit index {index_path}")
+
+    head = resolve(mirror_path, branch_ref(branch))
+    index = CommitIndex(**indexes.get(branch, {}))
+    if index.head == head:
+        return index
+    if head is None:
+        index = CommitIndex()
+    elif index.head and _git(f"--git-dir={mirror_path}", "merge-base", "--is-ancestor", index.head, head,
+                             check=False).returncode == 0:
+        # the stable sort keeps commits with the same date in the order git log shows them
+        new_commits = reversed(_log_commits(mirror_path, f"{index.head}..{head}"))
+        index = CommitIndex(head, sorted([*index.commits, *new_commits], key=lambda commit: commit[0]))
+    else:
+        # first time, or the branch was force pushed
+        index = CommitIndex(head, sorted(reversed(_log_commits(mirror_path, head)), key=lambda commit: commit[0]))
+
+    indexes[branch] = {"head": index.head, "commits": index.commits}
+    tmp_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(indexes))
+    os.replace(tmp_path, index_path)
+    return index
+
+
+def last_commit_before(mirror_path: pathlib.Path, branch: str, unix_timestamp: int) -> str:
+    commit_id = commit_index(mirror_path, branch).last_before(unix_timestamp)
+    if commit_id is None:
+        raise GitError(f"No commit on {branch} before {unix_timestamp}")
+    return commit_id
+
+
+def _force_remove(path: pathlib.Path):
+    # apparently some students' code creates directories without read access, so we ensure rwx permissions
+    completed_chown = subprocess.run(["chmod", "-R", "744", path], capture_output=cfg.CAPTURE_OUTPUT)
+    if completed_chown.returncode != 0:
+        logging.warning(f"Could not change dir permissions on {path}, removal may fail")
+    shutil.rmtree(path)
+
+
+def checkout(mirror_path: pathlib.Path, worktree_path: pathlib.Path, commit_id: str):
+    # reuses the existing worktree when there is one, only files that differ from commit_id get rewritten
+    if (worktree_path / ".git").is_file():
+        subprocess.run(["chmod", "-R", "u+rwx", worktree_path], capture_output=cfg.CAPTURE_OUTPUT)
+        checkout_result = _git("checkout", "--quiet", "--detach", "--force", commit_id, cwd=worktree_path, check=False)
+        if checkout_result.returncode == 0:
+            _git("clean", "-ffdxq", cwd=worktree_path)
+            return
+        logging.warning(f"Could not reuse worktree {worktree_path}, recreating it")
+
+    if os.path.lexists(worktree_path):
+        _force_remove(worktree_path)
+    _git(f"--git-dir={mirror_path}", "worktree", "prune")
+    worktree_path.parent.mkdir(parents=True, exist_ok=True)
+    _git(f"--git-dir={mirror_path}", "worktree", "add", "--quiet", "--detach", "--force", str(worktree_path),
+         commit_id)
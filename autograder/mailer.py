@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from autograder import cfg, timing
+
+_STOP = object()
+
+_queue = queue.Queue()
+_dispatcher = None
+_mailjet = None
+
+
+def _client():
+    global _mailjet
+    if _mailjet is None:
+        from mailjet_rest import Client  # pulls in requests, only worth it once there is something to send
+        _mailjet = Client(auth=(cfg.MJ_USERNAME, cfg.MJ_PASSWORD), version='v3.1', api_url=cfg.MJ_API_URL)
+    return _mailjet
+
+
+def start():
+    # messages a previous run couldn't deliver are still in the outbox and go out first
+    global _dispatcher
+    cfg.AUTOGRADER_OUTBOX_PATH.mkdir(parents=True, exist_ok=True)
+    for outbox_file in sorted(cfg.AUTOGRADER_OUTBOX_PATH.glob("*.json")):
+        try:
+            with open(outbox_file, 'r') as f:
+                _queue.put(json.load(f))
+            logging.info(f"Resending {outbox_file.stem} from the outbox")
+        except (OSError, ValueError):
+            logging.error(f"Unreadable message {outbox_file} in the outbox, skipping it")
+    _dispatcher = threading.Thread(target=_dispatch, name="mailer", daemon=True)
+    _dispatcher.start()
+
+
+def stop():
+    # waits for everything queued so far to be sent or given up on
+    global _dispatcher
+    if _dispatcher is not None:
+        _queue.put(_STOP)
+        _dispatcher.join()
+        _dispatcher = None
+
+
+def enqueue(to, body, id, attachments):
+    to_list = list(map(lambda addr: {"Email": addr}, to))
+    outbox_id = uuid.uuid4().hex
+    message = {
+        "outbox_id": outbox_id,
+        "id": id,
+        "to": to,
+        "message": {
+            "From": {
+                "Email": os.getenv("AUTOGRADER_EMAIL_FROM_ADDR", default="sebastian.rolon@mcgill.ca"),
+                "Name": "COMP310 Autograder"
+            },
+            "To": to_list,
+            "Subject": "COMP310 Autograder Report",
+            "TextPart": body,
+            "Attachments": attachments,
+            "CustomID": outbox_id
+        }
+    }
+
+    # persisted before it is queued, so a crash can't lose it
+    cfg.AUTOGRADER_OUTBOX_PATH.mkdir(parents=True, exist_ok=True)
+    tmp_path = cfg.AUTOGRADER_OUTBOX_PATH / f"{outbox_id}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(message, f)
+    os.replace(tmp_path, cfg.AUTOGRADER_OUTBOX_PATH / f"{outbox_id}.json")
+
+    if _dispatcher is None:
+        logging.warning(f"Mail dispatcher not running, email for {id} stays in the outbox")
+    else:
+        _queue.put(message)
+
+
+def _attachment_bytes(message) -> int:
+    return sum(len(attachment["Base64Content"]) for attachment in message["message"]["Attachments"])
+
+
+def _dispatch():
+    stopping = False
+    # the message that didn't fit in the last batch
+    carried = None
+    while not stopping:
+        message = _queue.get() if carried is None else carried
+        carried = None
+        if message is _STOP:
+            break
+        batch = [message]
+        batch_bytes = _attachment_bytes(message)
+        # give other workers a moment to finish their reports so they share the request
+        batch_deadline = time.monotonic() + cfg.AUTOGRADER_MAIL_BATCH_DELAY
+        while len(batch) < cfg.AUTOGRADER_MAIL_BATCH_SIZE:
+            try:
+                message = _queue.get(timeout=max(0.0, batch_deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if message is _STOP:
+                stopping = True
+                break
+            # the request body is held in memory, along with its serialized copy
+            message_bytes = _attachment_bytes(message)
+            if batch_bytes + message_bytes > cfg.AUTOGRADER_MAIL_BATCH_MAX_BYTES:
+                carried = message
+                break
+            batch.append(message)
+            batch_bytes += message_bytes
+        _send_with_retries(batch)
+
+
+def _send_with_retries(batch):
+    for attempt in range(cfg.AUTOGRADER_MAIL_RETRIES + 1):
+        if attempt > 0:
+            time.sleep(cfg.AUTOGRADER_MAIL_RETRY_BACKOFF * 2 ** (attempt - 1))
+        with timing.phase("send", test=f"{len(batch)} emails"):
+            batch = _send_batch(batch)
+        if not batch:
+            return
+    for message in batch:
+        logging.error(f"Giving up on email for {message['id']} members {message['to']}, it stays in the outbox")
+
+
+def _send_batch(batch):
+    # returns the messages that should be tried again
+    sandbox = cfg.DEBUG
+    data = {
+        'Messages': [message["message"] for message in batch],
+        'SandboxMode': sandbox
+    }
+    try:
+        result = _client().send.create(data=data)
+    except Exception as e:
+        logging.error(f"Exception sending {len(batch)} emails ({e.__class__.__name__})")
+        return batch
+
+    if result.status_code == 429 or result.status_code >= 500:
+        logging.warning(f"Sending {len(batch)} emails failed with status {result.status_code}, will retry")
+        return batch
+
+    if result.status_code == 200:
+        statuses = ["success"] * len(batch)
+    else:
+        # mailjet reports per message why a batch was rejected, the others still went through
+        try:
+            statuses = [message_result.get("Status") for message_result in result.json()["Messages"]]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            statuses = []
+        if len(statuses) != len(batch):
+            statuses = ["error"] * len(batch)
+
+    for message, status in zip(batch, statuses):
+        if status == "success":
+            logging.info(f"(SANDBOX {sandbox}) Sent email to {message['id']} members {message['to']}")
+            _remove_from_outbox(message)
+        else:
+            logging.error(f"Email sending to {message['id']} members {message['to']} failed with status "
+                          f"{result.status_code}")
+            _move_to_failed(message)
+    return []
+
+
+def _remove_from_outbox(message):
+    try:
+        os.remove(cfg.AUTOGRADER_OUTBOX_PATH / f"{message['outbox_id']}.json")
+    except FileNotFoundError:
+        pass
+
+
+def _move_to_failed(message):
+    # retrying won't help, kept aside for a human to look at instead of being resent every run
+    failed_path = cfg.AUTOGRADER_OUTBOX_PATH / "failed"
+    failed_path.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(cfg.AUTOGRADER_OUTBOX_PATH / f"{message['outbox_id']}.json",
+                   failed_path / f"{message['outbox_id']}.json")
+    except FileNotFoundError:
+        pass
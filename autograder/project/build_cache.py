@@ -0,0 +1,132 @@
+import logging
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from autograder import cfg, timing
+from autograder.project import compiler_cache, execution, scheduler
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+_run_local_cache = None
+# builds that failed during this run aren't retried by every test that needs them. they aren't kept across runs,
+# a timeout may have been the machine's fault
+_failed_builds = {}
+
+
+class BuildError(Exception):
+    pass
+
+
+class BuildTimeout(BuildError):
+    # may have been the machine's fault rather than the code's
+    pass
+
+
+def _lock_for(key: pathlib.Path) -> threading.Lock:
+    with _key_locks_lock:
+        if key not in _key_locks:
+            _key_locks[key] = threading.Lock()
+        return _key_locks[key]
+
+
+def _cache_root() -> pathlib.Path:
+    global _run_local_cache
+    # local copies may carry uncommitted changes, so their commit id doesn't identify what gets built
+    if not cfg.AUTOGRADER_DISABLE_BUILD_CACHE and not cfg.AUTOGRADER_USE_LOCAL_COPY:
+        return cfg.AUTOGRADER_BUILD_CACHE_PATH
+    # binaries still have to outlive the scratch dir they were built in, they just aren't kept across runs
+    with _key_locks_lock:
+        if _run_local_cache is None:
+            _run_local_cache = tempfile.TemporaryDirectory(prefix="autograder-build-")
+        return pathlib.Path(_run_local_cache.name)
+
+
+def entry_path(commit_id: str, frame_sz=18, var_sz=10) -> pathlib.Path:
+    return _cache_root() / commit_id / f"{frame_sz}_{var_sz}"
+
+
+def build(src_location: pathlib.Path, commit_id: str, frame_sz=18, var_sz=10, timeout=None,
+          clean_must_succeed=True) -> pathlib.Path:
+    if timeout is None:
+        timeout = cfg.AUTOGRADER_BUILD_TIMEOUT
+    # binaries are keyed on (commit, framesize, varmemsize), so each combination is compiled once and reused
+    entry = entry_path(commit_id, frame_sz, var_sz)
+    with _lock_for(entry):
+        cached_binary = entry / "mysh"
+        if cached_binary.is_file():
+            logging.debug(f"Build cache hit for {commit_id} framesize={frame_sz} varmemsize={var_sz}")
+            os.utime(entry.parent)  # keeps entries that are still in use from being pruned
+            clean_error_path = entry / "clean_error"
+            if clean_must_succeed and clean_error_path.is_file():
+                raise BuildError(clean_error_path.read_text())
+            return cached_binary
+
+        failure_key = (entry, timeout, clean_must_succeed)
+        if failure_key in _failed_builds:
+            error_class, message = _failed_builds[failure_key]
+            raise error_class(message)
+
+        # builds with different parameters may run at the same time, so each one gets its own copy of the sources
+        with timing.phase("build"), tempfile.TemporaryDirectory(prefix="autograder-src-") as scratch_dir:
+            scratch_src = pathlib.Path(scratch_dir, "src")
+            shutil.copytree(src_location, scratch_src, symlinks=True)
+            try:
+                with scheduler.stage("build"):
+                    clean_error = _make(scratch_src, frame_sz, var_sz, timeout, clean_must_succeed)
+            except BuildError as e:
+                _failed_builds[failure_key] = (type(e), str(e))
+                raise
+
+            # copy then rename so that a partially written binary is never picked up by a later run
+            entry.mkdir(parents=True, exist_ok=True)
+            tmp_binary = entry / f"mysh.{threading.get_ident()}.tmp"
+            shutil.copy2(scratch_src / "mysh", tmp_binary)
+            if clean_error:
+                (entry / "clean_error").write_text(clean_error)
+            os.replace(tmp_binary, cached_binary)
+        return cached_binary
+
+
+def _make(src_location, frame_sz, var_sz, timeout, clean_must_succeed):
+    # some students are committing their binaries, we need to run make clean first
+    clean_error = None
+    try:
+        clean_returncode = execution.run_command(["make", "clean"], src_location, timeout, cfg.CAPTURE_OUTPUT)
+        if clean_returncode != 0:
+            clean_error = f"'make clean' failed (return code {clean_returncode})"
+    except Exception as e:
+        clean_error = f"'make clean' failed ({e.__class__.__name__})"
+    if clean_error and clean_must_succeed:
+        raise BuildError(clean_error)
+
+    make_command_line = cfg.autograder_make_command_line(frame_sz, var_sz, compiler_cache.launcher())
+    env = compiler_cache.environment(src_location) if compiler_cache.available() else None
+    try:
+        make_returncode = execution.run_command(make_command_line, src_location, timeout, cfg.CAPTURE_OUTPUT, env)
+    except subprocess.TimeoutExpired as e:
+        raise BuildTimeout(f"'make' failed ({e.__class__.__name__})")
+    except Exception as e:
+        raise BuildError(f"'make' failed ({e.__class__.__name__})")
+    if make_returncode != 0:
+        raise BuildError(f"'make' failed (return code {make_returncode})")
+
+    # make might have exited correctly, but mysh might not be there
+    if not os.path.isfile(f"{src_location}/mysh"):
+        raise BuildError("'make' did not produce mysh")
+
+    return clean_error
+
+
+def prune(max_age_days: int):
+    if not cfg.AUTOGRADER_BUILD_CACHE_PATH.is_dir():
+        return
+    oldest_allowed = time.time() - max_age_days * 24 * 60 * 60
+    for commit_dir in cfg.AUTOGRADER_BUILD_CACHE_PATH.iterdir():
+        if commit_dir.stat().st_mtime < oldest_allowed:
+            logging.debug(f"Pruning build cache entry {commit_dir.name}")
+            shutil.rmtree(commit_dir, ignore_errors=True)
@@ -0,0 +1,92 @@
+import difflib
+from collections import Counter
+
+PASS_THRESHOLD = 0.9
+
+
+def ordered(actual: str, expected: str, threshold: float = PASS_THRESHOLD) -> float:
+    return ordered_tokens(actual.split(), expected.split(), threshold)
+
+
+def ordered_tokens(actual_tokens, expected_tokens, threshold: float = PASS_THRESHOLD) -> float:
+    # difflib's ratio() is quadratic, so cheap upper bounds on it are checked first and it only runs on outputs
+    # that can still reach the threshold, which are never much longer than the expected output. below the
+    # threshold the returned score is one of those bounds rather than the exact ratio
+    # the common case for a correct shell
+    if actual_tokens == expected_tokens:
+        return 1.0
+    total = len(actual_tokens) + len(expected_tokens)
+
+    max_edits = _max_edits(total, threshold)
+
+    # every token that is only in one of the sequences needs an edit, so the length difference is a lower bound
+    if abs(len(actual_tokens) - len(expected_tokens)) > max_edits:
+        return 2.0 * min(len(actual_tokens), len(expected_tokens)) / total
+
+    # neither the longest common subsequence nor difflib's matches can exceed the shared multiset of tokens
+    common = sum((Counter(actual_tokens) & Counter(expected_tokens)).values())
+    if total - 2 * common > max_edits:
+        return 2.0 * common / total
+
+    # difflib's matches are a common subsequence, so they can't beat the LCS
+    if _edit_distance(expected_tokens, actual_tokens, max_edits) is None:
+        return (total - max_edits - 1) / total
+
+    return difflib.SequenceMatcher(isjunk=None, a=expected_tokens, b=actual_tokens, autojunk=False).ratio()
+
+
+def jaccard(actual: str, expected: str) -> float:
+    return jaccard_sets(set(actual.split()), set(expected.split()))
+
+
+def jaccard_sets(actual_set, expected_set) -> float:
+    intersection_size = len(actual_set & expected_set)
+    union_size = len(actual_set) + len(expected_set) - intersection_size
+    if union_size == 0:
+        return 1.0
+    return float(intersection_size / union_size)
+
+
+def _max_edits(total: int, threshold: float) -> int:
+    # largest number of insertions + deletions that still gives a ratio >= threshold, computed with the same
+    # float division the ratio uses so borderline cases agree
+    max_edits = int((1 - threshold) * total)
+    while max_edits + 1 <= total and (total - max_edits - 1) / total >= threshold:
+        max_edits += 1
+    while max_edits >= 0 and (total - max_edits) / total < threshold:
+        max_edits -= 1
+    return max_edits
+
+
+def _edit_distance(a, b, max_edits: int):
+    # Myers' O((N+M)D) greedy algorithm, insertions and deletions only. returns None when more than max_edits
+    # edits are needed
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a = a[start:end_a]
+    b = b[start:end_b]
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return n + m if n + m <= max_edits else None
+
+    offset = max_edits + 1
+    furthest = [0] * (2 * max_edits + 3)
+    for d in range(max_edits + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and furthest[offset + k - 1] < furthest[offset + k + 1]):
+                x = furthest[offset + k + 1]
+            else:
+                x = furthest[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            furthest[offset + k] = x
+            if x >= n and y >= m:
+                return d
+    return None
@@ -0,0 +1,79 @@
+import functools
+import logging
+import os
+import shutil
+import subprocess
+
+from autograder import cfg
+
+# builds go through ccache when it is installed, so a new commit, framesize or varmemsize only recompiles the
+# files whose preprocessed source changed. the cache is bounded by AUTOGRADER_COMPILER_CACHE_MAX_MB, ccache
+# evicts the least recently used files beyond that
+
+# counters of `ccache --print-stats`
+HIT_STATS = ("direct_cache_hit", "preprocessed_cache_hit")
+MISS_STATS = ("cache_miss",)
+
+
+@functools.lru_cache(maxsize=None)
+def available() -> bool:
+    if cfg.AUTOGRADER_DISABLE_COMPILER_CACHE:
+        return False
+    if shutil.which("ccache") is None:
+        logging.warning("ccache not found, builds compile every file")
+        return False
+    return True
+
+
+def launcher():
+    # prepended to the compiler in the make command line
+    return "ccache" if available() else None
+
+
+def environment(src_location=None) -> dict:
+    env = {
+        **os.environ,
+        "CCACHE_DIR": str(cfg.AUTOGRADER_COMPILER_CACHE_PATH),
+        "CCACHE_MAXSIZE": f"{cfg.AUTOGRADER_COMPILER_CACHE_MAX_MB}M",
+    }
+    if src_location is not None:
+        # every build runs in a scratch copy of the sources, paths below it are hashed relative to it so that
+        # builds of the same files hit wherever they were copied to
+        env["CCACHE_BASEDIR"] = str(src_location)
+        env["CCACHE_NOHASHDIR"] = "1"
+    return env
+
+
+def _ccache(*args) -> subprocess.CompletedProcess:
+    return subprocess.run(["ccache", *args], env=environment(), capture_output=True, text=True)
+
+
+def start():
+    # counts from zero, so the summary covers this run only
+    if available():
+        cfg.AUTOGRADER_COMPILER_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        _ccache("--zero-stats")
+
+
+def stats() -> dict:
+    completed = _ccache("--print-stats")
+    if completed.returncode != 0:
+        # older than ccache 4.4
+        return {}
+    counters = {}
+    for line in completed.stdout.splitlines():
+        name, _, value = line.partition("\t")
+        if value.strip().isdigit():
+            counters[name] = int(value)
+    return counters
+
+
+def log_stats():
+    if not available():
+        return
+    counters = stats()
+    hits = sum(counters.get(name, 0) for name in HIT_STATS)
+    misses = sum(counters.get(name, 0) for name in MISS_STATS)
+    if hits + misses == 0:
+        return
+    logging.info(f"Compiler cache: {hits} hits, {misses} misses, hit rate {hits / (hits + misses):.0%}")
@@ -0,0 +1,128 @@
+import os
+import select
+import selectors
+import signal
+import subprocess
+import time
+import typing
+
+from autograder import timing
+
+READ_CHUNK_SIZE = 64 * 1024
+# how often a run that can be cancelled checks whether it still matters
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class RunResult(typing.NamedTuple):
+    returncode: typing.Optional[int]
+    output: bytes
+    timed_out: bool = False
+    truncated: bool = False
+    cancelled: bool = False
+    cpu_time: float = 0.0
+    max_rss_kb: int = 0
+
+
+def run_bounded(args, input_path, cwd, timeout: float, max_output_bytes: int, is_cancelled=None) -> RunResult:
+    # stdout is read while the program runs, so a chatty program can't block on a full pipe, and at most
+    # max_output_bytes are kept before the program is killed
+    with open(input_path, 'rb') as input_file:
+        process = subprocess.Popen(args,
+                                   cwd=cwd,
+                                   stdin=input_file,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL,
+                                   start_new_session=True)  # crucial to ensure spawned processes die
+    # https://alexandra-zaharia.github.io/posts/kill-subprocess-and-its-children-on-timeout-python/
+
+    chunks = []
+    rusage = None
+    output_size = 0
+    timed_out = truncated = cancelled = False
+    deadline = time.monotonic() + timeout
+    with process.stdout, selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ)
+        stdout_open = True
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            if is_cancelled and is_cancelled():
+                cancelled = True
+                break
+            wait_time = min(remaining, CANCEL_POLL_INTERVAL) if is_cancelled else remaining
+
+            if stdout_open:
+                if not selector.select(timeout=wait_time):
+                    continue
+                data = os.read(process.stdout.fileno(), READ_CHUNK_SIZE)
+                if not data:
+                    stdout_open = False
+                    continue
+                kept = data[:max_output_bytes - output_size]
+                chunks.append(kept)
+                output_size += len(kept)
+                if len(kept) < len(data):
+                    truncated = True
+                    break
+            else:
+                try:
+                    rusage = wait(process, timeout=wait_time)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+
+    # also takes care of whatever the program left running in the background
+    _kill_group(process)
+    rusage = wait(process) or rusage
+    returncode = process.returncode
+    if returncode < 0:
+        # same convention as the shell, e.g. 139 for a segmentation fault
+        returncode = 128 - returncode
+    if rusage is None:
+        return RunResult(returncode, b"".join(chunks), timed_out, truncated, cancelled)
+    return RunResult(returncode, b"".join(chunks), timed_out, truncated, cancelled,
+                     rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss)
+
+
+def run_command(args, cwd, timeout: float, capture_output=True, env=None) -> int:
+    # like subprocess.run for commands whose output isn't needed, but on timeout everything the command
+    # started is killed too
+    stream = subprocess.DEVNULL if capture_output else None
+    process = subprocess.Popen(args, cwd=cwd, stdout=stream, stderr=stream, env=env, start_new_session=True)
+    try:
+        wait(process, timeout)
+    except subprocess.TimeoutExpired:
+        _kill_group(process)
+        wait(process)
+        raise
+    return process.returncode
+
+
+def wait(process: subprocess.Popen, timeout=None):
+    # like process.wait, but reaps the child with wait4 and returns its resource usage (None when it was
+    # already reaped or can't be measured)
+    if process.returncode is not None:
+        return None
+    try:
+        pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        process.wait(timeout)
+        return None
+    try:
+        if not select.select([pidfd], [], [], timeout)[0]:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+    finally:
+        os.close(pidfd)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    timing.add_child_usage(rusage)
+    return rusage
+
+
+def _kill_group(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
@@ -0,0 +1,78 @@
+import collections
+import hashlib
+import logging
+import threading
+
+from autograder import cfg
+
+# many forks print exactly the same output for a test, mostly the right answer or a common wrong one, so each
+# distinct output is scored once per run. entries are keyed on the test and a hash of the output, the least
+# recently used ones are dropped beyond AUTOGRADER_OUTPUT_CACHE_SIZE. the forks behind each output are kept
+# for the summary of the outputs most forks share
+
+SUMMARY_SIZE = 5
+# forks with the same output for it to be worth mentioning
+CLUSTER_MIN_FORKS = 3
+
+
+class Entry:
+    def __init__(self, score: float, variant):
+        self.score = score
+        # the expected output that gave the score
+        self.variant = variant
+        self.forks = set()
+
+
+_lock = threading.Lock()
+_entries = collections.OrderedDict()
+_hits = 0
+_misses = 0
+
+
+def key(test_id: str, output: str) -> tuple:
+    return test_id, hashlib.blake2b(output.encode('utf-8'), digest_size=16).digest()
+
+
+def get(entry_key: tuple, fork: str):
+    # (score, variant) of an output already scored, None otherwise
+    global _hits, _misses
+    if cfg.AUTOGRADER_OUTPUT_CACHE_SIZE <= 0:
+        return None
+    with _lock:
+        entry = _entries.get(entry_key)
+        if entry is None:
+            _misses += 1
+            return None
+        _hits += 1
+        _entries.move_to_end(entry_key)
+        entry.forks.add(fork)
+        return entry.score, entry.variant
+
+
+def put(entry_key: tuple, fork: str, score: float, variant):
+    if cfg.AUTOGRADER_OUTPUT_CACHE_SIZE <= 0:
+        return
+    with _lock:
+        # another thread may have scored the same output meanwhile
+        entry = _entries.setdefault(entry_key, Entry(score, variant))
+        entry.forks.add(fork)
+        _entries.move_to_end(entry_key)
+        while len(_entries) > cfg.AUTOGRADER_OUTPUT_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def log_stats():
+    with _lock:
+        hits, misses = _hits, _misses
+        clusters = sorted(((entry_key[0], entry) for entry_key, entry in _entries.items()
+                           if len(entry.forks) >= CLUSTER_MIN_FORKS),
+                          key=lambda cluster: len(cluster[1].forks), reverse=True)
+    if hits + misses == 0:
+        return
+    logging.info(f"Output cache: {hits} hits, {misses} misses, hit rate {hits / (hits + misses):.0%}")
+    if clusters:
+        logging.info("Outputs shared by the most forks:")
+    for test_id, entry in clusters[:SUMMARY_SIZE]:
+        forks = sorted(entry.forks)
+        logging.info(f"  {test_id:<25} {len(forks):>5} forks score {entry.score:.2f} against "
+                     f"{entry.variant or 'nothing'}: {' '.join(forks[:10])}{' ...' if len(forks) > 10 else ''}")
@@ -1,54 +1,8 @@
 import base64
-import csv
 import logging
-import os
-import threading
-
-from mailjet_rest import Client
-
-from autograder import cfg
-
-mailjet = Client(
-    auth=(cfg.MJ_USERNAME, cfg.MJ_PASSWORD),
-    version='v3.1')
-
-csv_lock = threading.Lock()
-csv_writer = csv.writer(cfg.AUTOGRADER_CSV_REPORT_FILE)
-
-
-def write_csv_line(team_id, test_name, result):
-    with csv_lock:
-        csv_writer.writerow([team_id, test_name, result])
-
-
-def mj_send_email(to, body, id, attachments):
-    sandbox = cfg.DEBUG
-
-    to_list = list(map(lambda addr: {"Email": addr}, to))
-    data = {
-        'Messages': [
-            {
-                "From": {
-                    "Email": os.getenv("AUTOGRADER_EMAIL_FROM_ADDR", default="sebastian.rolon@mcgill.ca"),
-                    "Name": "COMP310 Autograder"
-                },
-                "To": to_list,
-                "Subject": "COMP310 Autograder Report",
-                "TextPart": body,
-                "Attachments": attachments
-            }
-        ],
-        'SandboxMode': sandbox
-    }
-    try:
-        result = mailjet.send.create(data=data)
-        if result.status_code == 200:
-            logging.info(f"(SANDBOX {sandbox}) Sent email to {id} members {to}")
-        else:
-            logging.error(f"Email sending to {id} members {to} failed with status {result.status_code}")
-    except:
-        logging.error(f"Exception sending email for {id}")
 
+from autograder import cfg, mailer
+from autograder.project import build_cache
 
 RETURN_CODES = {
     132: "Illegal operation (SIGILL)",
@@ -57,7 +11,9 @@ RETURN_CODES = {
     136: "Program aborted (SIGFPE)",
     137: "Too much memory",
     138: "Program aborted (SIGBUS)",
-    139: "Segmentation fault (SIGSEGV)"
+    139: "Segmentation fault (SIGSEGV)",
+    152: "CPU time limit exceeded (SIGXCPU)",
+    153: "File size limit exceeded (SIGXFSZ)"
 }
 
 
@@ -65,27 +21,40 @@ class Reporter:
     PASS = "PASS"
     FAIL = "FAIL"
     TIMEOUT = "TIMEOUT"
+    SKIPPED = "SKIPPED"
+    # only in the results database, the csv report never had these
+    EXIT = "EXIT"
+    BUILD_FAILED = "BUILD_FAILED"
 
-    _mailjet = None
     _emails = None
 
     _reporters = {}
 
-    _output_attachments = {}
-
     @staticmethod
     def get_reporter(project_identifier: str):
         return Reporter._reporters[project_identifier]
 
-    def __init__(self, project_name: str):
+    def __init__(self, project_name: str, deadline=None, keep_outputs=True):
         # self._emails = emails
 
         self.project_name = project_name
         project_unique_id = project_name.split('/')[0]
+        self.commit_id = None
+        # see results_db.deadline_key
+        self.deadline = deadline
+        # only reports that get emailed need the outputs
+        self.keep_outputs = keep_outputs
 
         self.message_buffer = []
-
-        self.per_test_buffer = []
+        # one dict per reported result, see results_db.py
+        self.results = []
+        # test name -> measurements of its last run, added to the result reported for it
+        self.run_details = {}
+        # a build or a test timed out, which may have been the machine's fault, so the report isn't stored
+        self.timed_out = False
+        # outputs live on disk until the email is built, the dict only holds them if the folder is unusable
+        self._output_files = {}
+        self._unwritten_outputs = {}
 
         self.current_buffer = self.message_buffer
 
@@ -114,51 +83,168 @@ class Reporter:
 
     def succeed(self, test_name: str):
         self.current_buffer.append(f"# {test_name:<25} {self.PASS}")
-        write_csv_line(self.project_name, test_name, "PASS")
+        self.write_result(test_name, self.PASS)
 
     def fail(self, test_name: str):
         self.current_buffer.append(f"# {test_name:<25} {self.FAIL}")
-        write_csv_line(self.project_name, test_name, "FAIL")
+        self.write_result(test_name, self.FAIL)
 
     def timeout(self, test_name: str):
+        self.timed_out = True
         self.current_buffer.append(f"# {test_name:<25} {self.TIMEOUT}")
-        write_csv_line(self.project_name, test_name, "TIMEOUT")
+        self.write_result(test_name, self.TIMEOUT)
+
+    def skip(self, test_name: str):
+        self.current_buffer.append(f"# {test_name:<25} {self.SKIPPED} (too many timeouts or crashes before it)")
+        self.write_result(test_name, self.SKIPPED)
+
+    def build_failed(self, test_name: str, error: Exception):
+        if isinstance(error, build_cache.BuildTimeout):
+            self.timed_out = True
+        self.current_buffer.append(f"# {test_name:<25} {error}")
+        self.write_result(test_name, self.BUILD_FAILED)
+
+    def write_result(self, test_name: str, result: str):
+        self.results.append({"test": test_name, "result": result, **self.run_details.get(test_name, {})})
 
     def exit_code(self, test_name: str, exit_code: int):
         if exit_code in RETURN_CODES:
             self.current_buffer.append(f"# {test_name:<25} {RETURN_CODES[exit_code]}")
         else:
             self.current_buffer.append(f"# {test_name:<25} Abnormal exit code {exit_code}")
+        self.write_result(test_name, self.EXIT)
 
-    def enable_per_test_buffer(self):
-        self.per_test_buffer = []
-        self.current_buffer = self.per_test_buffer
+    def record_run(self, test_name: str, **details):
+        # e.g. duration, exit_code, cpu_time, max_rss_kb and score
+        self.run_details.setdefault(test_name, {}).update(details)
 
-    def flush_per_test_buffer(self):
-        self.message_buffer.extend(self.per_test_buffer)
-        self.current_buffer = self.message_buffer
+    def merge(self, test_report: "TestReport", assignment_name=None):
+        self.current_buffer.extend(test_report.message_buffer)
+        self.timed_out = self.timed_out or test_report.timed_out
+        for result in test_report.results:
+            self.results.append({"assignment": assignment_name, **result})
+        for test_name, test_output in test_report.read_outputs():
+            self.add_output(test_name, test_output)
 
     def add_output(self, test_name: str, test_output: str):
-        self._output_attachments[test_name] = {
-            "ContentType": "text/plain",
-            "Filename": f"{test_name}_output.txt",
-            "Base64Content": base64.b64encode(bytes(test_output, 'utf-8')).decode('utf-8')
-        }
-
+        if not self.keep_outputs:
+            return
         if self.can_write_outputs:
-            with open(self.test_outputs_folder / f"{test_name}_output.txt", 'w') as f:
+            output_path = self.test_outputs_folder / f"{test_name}_output.txt"
+            with open(output_path, 'w') as f:
                 f.write(test_output)
+            self._output_files[test_name] = output_path
+        elif sum(map(len, self._unwritten_outputs.values())) + len(test_output) <= cfg.AUTOGRADER_MAX_ATTACHMENT_BYTES:
+            self._unwritten_outputs[test_name] = test_output
+        else:
+            logging.warning(f"Dropping output of {test_name} for {self.project_name}, no space left to keep it")
+
+    def read_outputs(self):
+        for test_name, output_path in self._output_files.items():
+            with open(output_path, 'r') as f:
+                yield test_name, f.read()
+        yield from self._unwritten_outputs.items()
+
+    def output_size(self, test_name: str) -> int:
+        if test_name in self._output_files:
+            return self._output_files[test_name].stat().st_size
+        return len(self._unwritten_outputs[test_name].encode('utf-8'))
+
+    def attachments(self):
+        # encoded only now, and only as much as fits in one email
+        attachments = []
+        too_large = []
+        space_left = cfg.AUTOGRADER_MAX_ATTACHMENT_BYTES
+        test_names = list(self._output_files) + list(self._unwritten_outputs)
+        for test_name in test_names:
+            size = self.output_size(test_name)
+            if size > space_left:
+                too_large.append(test_name)
+                continue
+            space_left -= size
+            if test_name in self._output_files:
+                test_output = self._output_files[test_name].read_bytes()
+            else:
+                test_output = self._unwritten_outputs[test_name].encode('utf-8')
+            attachments.append({
+                "ContentType": "text/plain",
+                "Filename": f"{test_name}_output.txt",
+                "Base64Content": base64.b64encode(test_output).decode('utf-8')
+            })
+        return attachments, too_large
+
+    def snapshot(self) -> dict:
+        return {
+            "message_buffer": self.message_buffer,
+            "commit_id": self.commit_id,
+            "results": self.results,
+            "outputs": dict(self.read_outputs()),
+        }
+
+    def replay(self, snapshot: dict):
+        self.message_buffer = snapshot["message_buffer"]
+        self.current_buffer = self.message_buffer
+        self.commit_id = snapshot["commit_id"]
+        self.results = snapshot["results"]
+        for test_name, test_output in snapshot["outputs"].items():
+            self.add_output(test_name, test_output)
 
     def send_email(self):
+        attachments, too_large = self.attachments()
+        if too_large:
+            self.message_buffer.append(f"Outputs not attached because they are too large: {', '.join(too_large)}")
         full_message_body = "\n".join(self.message_buffer)
         if cfg.DEBUG:
             print(full_message_body)
 
         if self.project_name in cfg.FORKS:
-            mj_send_email(cfg.FORKS[self.project_name], full_message_body, self.project_name, list(self._output_attachments.values()))
+            mailer.enqueue(cfg.FORKS[self.project_name], full_message_body, self.project_name, attachments)
             cfg.AUTOGRADER_REPORT_PATH.mkdir(parents=True, exist_ok=True)
             with open(f"{cfg.AUTOGRADER_WORKING_DIR}/reports/{self.project_name.split('/')[0]}.txt", 'w') as f:
                 f.write(full_message_body)
                 f.close()
         else:
             logging.error(f"No emails found for {self.project_name}")
+
+        self.discard()
+
+    def discard(self):
+        # nothing refers to this report anymore
+        Reporter._reporters.pop(self.project_name, None)
+
+
+class TestReport(Reporter):
+    # collects what a single test reports so that tests can run concurrently and be merged in a fixed order
+
+    def __init__(self, project_name: str):
+        self.project_name = project_name
+        self.message_buffer = []
+        self.current_buffer = self.message_buffer
+        self.results = []
+        self.run_details = {}
+        self.timed_out = False
+        self._output_files = {}
+        self._unwritten_outputs = {}
+        # what fail-fast needs to know about the test
+        self.broken = False
+        self.skipped = False
+        self.cancelled = False
+
+    def timeout(self, test_name: str):
+        super().timeout(test_name)
+        self.broken = True
+
+    def exit_code(self, test_name: str, exit_code: int):
+        super().exit_code(test_name, exit_code)
+        # killed by a signal, e.g. a segmentation fault
+        if exit_code > 128:
+            self.broken = True
+
+    def skip(self, test_name: str):
+        super().skip(test_name)
+        self.broken = True
+        self.skipped = True
+
+    def add_output(self, test_name: str, test_output: str):
+        # a single output, already bounded by AUTOGRADER_MAX_OUTPUT_BYTES, held until the test is merged
+        self._unwritten_outputs[test_name] = test_output
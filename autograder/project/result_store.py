@@ -0,0 +1,64 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from autograder import cfg
+
+
+def key(commit_id: str, base_commit_id: str) -> str:
+    # anything that can change a grade without a new commit on either repo must be part of the key
+    key_material = {
+        "commit": commit_id,
+        "base_commit": base_commit_id,
+        "mt_iterations": cfg.AUTOGRADER_MT_ITERATIONS,
+        "order_matters": cfg.ORDER_MATTERS,
+        "run_multiple": cfg.RUN_MULTIPLE,
+        "make": cfg.autograder_make_command_line(),
+        "timeouts": [cfg.AUTOGRADER_BUILD_TIMEOUT, cfg.AUTOGRADER_RUN_TIMEOUT_MULTIPLIER,
+                     cfg.AUTOGRADER_MIN_RUN_TIMEOUT, cfg.AUTOGRADER_MAX_RUN_TIMEOUT],
+        "fail_fast_after": cfg.AUTOGRADER_FAIL_FAST_AFTER,
+        "limits": [cfg.AUTOGRADER_TEST_MEMORY_MB, cfg.AUTOGRADER_TEST_MAX_PIDS, cfg.AUTOGRADER_TEST_MAX_FILE_MB],
+        # output past it is cut off before it is scored
+        "max_output_bytes": cfg.AUTOGRADER_MAX_OUTPUT_BYTES,
+    }
+    return hashlib.sha256(json.dumps(key_material, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load(result_key: str):
+    result_path = cfg.AUTOGRADER_RESULTS_PATH / f"{result_key}.json"
+    try:
+        with open(result_path, 'r') as f:
+            result = json.load(f)
+        os.utime(result_path)  # keeps results that are still replayed from being pruned
+        return result
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logging.warning(f"Ignoring unreadable stored result {result_key}")
+        return None
+
+
+def save(result_key: str, result: dict):
+    cfg.AUTOGRADER_RESULTS_PATH.mkdir(parents=True, exist_ok=True)
+    # write to a private file and rename it so concurrent readers only ever see complete results
+    tmp_path = cfg.AUTOGRADER_RESULTS_PATH / f"{result_key}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f)
+    os.replace(tmp_path, cfg.AUTOGRADER_RESULTS_PATH / f"{result_key}.json")
+
+
+def prune(max_age_days: int):
+    if not cfg.AUTOGRADER_RESULTS_PATH.is_dir():
+        return
+    oldest_allowed = time.time() - max_age_days * 24 * 60 * 60
+    for result_path in cfg.AUTOGRADER_RESULTS_PATH.iterdir():
+        try:
+            if result_path.stat().st_mtime < oldest_allowed:
+                logging.debug(f"Pruning stored result {result_path.name}")
+                result_path.unlink()
+        except FileNotFoundError:
+            # e.g. a temporary file another process just renamed
+            pass
@@ -0,0 +1,219 @@
+import csv
+import datetime
+import sqlite3
+import sys
+import threading
+
+from autograder import cfg
+
+# every result of every run in one sqlite database next to the reports, e.g. to compare runs. a fork's results
+# are written in one transaction once it is graded, WAL lets queries read while a run is writing. the csv report
+# of each deadline is exported from here at the end of a run
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL,
+    fork TEXT NOT NULL,
+    commit_id TEXT,
+    deadline TEXT,
+    assignment TEXT,
+    test TEXT NOT NULL,
+    result TEXT NOT NULL,
+    score REAL,
+    duration REAL,
+    exit_code INTEGER,
+    cpu_time REAL,
+    max_rss_kb INTEGER
+);
+CREATE INDEX IF NOT EXISTS results_by_run ON results (run_id);
+CREATE INDEX IF NOT EXISTS results_by_test ON results (fork, assignment, test);
+CREATE TABLE IF NOT EXISTS forks (
+    run_id TEXT NOT NULL,
+    fork TEXT NOT NULL,
+    commit_id TEXT,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS forks_by_fork ON forks (fork, run_id);
+"""
+
+INSERT = """
+INSERT INTO results (run_id, fork, commit_id, deadline, assignment, test, result, score, duration, exit_code,
+                     cpu_time, max_rss_kb)
+VALUES (:run_id, :fork, :commit_id, :deadline, :assignment, :test, :result, :score, :duration, :exit_code,
+        :cpu_time, :max_rss_kb)
+"""
+
+# one outcome per test of a fork and deadline in a run, a RUN_MULTIPLE test passes if every run of it did
+OUTCOMES = """
+SELECT run_id, fork, commit_id, deadline, assignment, test, MIN(result = 'PASS') AS passed
+FROM results
+GROUP BY run_id, fork, commit_id, deadline, assignment, test
+"""
+
+CSV_RESULTS = ("PASS", "FAIL", "TIMEOUT", "SKIPPED")
+
+# runs of a fork looked at to predict how long it takes to grade
+HISTORY_RUNS = 5
+
+_lock = threading.Lock()
+_connection = None
+
+
+def connect(path=None) -> sqlite3.Connection:
+    connection = sqlite3.connect(path or cfg.AUTOGRADER_RESULTS_DB_PATH, timeout=60, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # a crash may lose the last transactions but never corrupts the database
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def deadline_key(deadline):
+    # how a deadline is stored, None when the run graded the latest commits
+    return deadline.strftime('%Y-%m-%d') if deadline else None
+
+
+def record(fork: str, reports: list, duration: float):
+    # the reports of one fork, one per deadline. the first one is for the main deadline
+    global _connection
+    rows = [{"run_id": cfg.AUTOGRADER_RUN_ID, "fork": fork, "commit_id": rep.commit_id, "deadline": rep.deadline,
+             "assignment": None, "score": None, "duration": None, "exit_code": None, "cpu_time": None,
+             "max_rss_kb": None, **result}
+            for rep in reports for result in rep.results]
+    with _lock:
+        if _connection is None:
+            _connection = connect()
+        with _connection:
+            _connection.executemany(INSERT, rows)
+            _connection.execute("INSERT INTO forks (run_id, fork, commit_id, duration) VALUES (?, ?, ?, ?)",
+                                (cfg.AUTOGRADER_RUN_ID, fork, reports[0].commit_id, round(duration, 3)))
+
+
+def fork_history() -> dict:
+    # fork -> (longest of its recent grading times, whether its commit changed between its last two runs)
+    global _connection
+    with _lock:
+        if _connection is None:
+            _connection = connect()
+        rows = _connection.execute("""
+            SELECT fork, commit_id, duration
+            FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY fork ORDER BY run_id DESC) AS n FROM forks)
+            WHERE n <= ?
+            ORDER BY fork, n""", (HISTORY_RUNS,)).fetchall()
+    runs = {}
+    for fork, commit_id, duration in rows:
+        runs.setdefault(fork, []).append((commit_id, duration))
+    return {fork: (max(duration for _, duration in fork_runs),
+                   len(fork_runs) > 1 and fork_runs[0][0] != fork_runs[1][0])
+            for fork, fork_runs in runs.items()}
+
+
+def close():
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+def csv_rows(connection: sqlite3.Connection, run_id: str, deadline=None) -> list:
+    # same rows as the csv report always had, of every deadline unless one is given
+    placeholders = ", ".join("?" * len(CSV_RESULTS))
+    return connection.execute(f"SELECT fork, test, result FROM results WHERE run_id = ? AND result IN "
+                              f"({placeholders}) AND (? IS NULL OR deadline = ?) ORDER BY rowid",
+                              (run_id, *CSV_RESULTS, deadline, deadline)).fetchall()
+
+
+def write_csv_reports():
+    # report_<deadline>.csv for every deadline of this run, only created if there is something to write to it
+    with _lock:
+        if _connection is None:
+            return
+        deadlines = [row[0] for row in _connection.execute("SELECT DISTINCT deadline FROM results WHERE run_id = ?",
+                                                           (cfg.AUTOGRADER_RUN_ID,))]
+        reports = {deadline: csv_rows(_connection, cfg.AUTOGRADER_RUN_ID, deadline) for deadline in deadlines}
+    for deadline, rows in reports.items():
+        if not rows:
+            continue
+        if deadline is None:
+            # graded without a deadline, named after it anyway like it always was
+            report_path = cfg.autograder_csv_report_path(cfg.AUTOGRADER_DEADLINE_VAL)
+        else:
+            report_path = cfg.autograder_csv_report_path(datetime.date.fromisoformat(deadline))
+        with open(report_path, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+
+
+def previous_run(connection: sqlite3.Connection, run_id=None):
+    # run ids are timestamps, the latest run when run_id is None
+    row = connection.execute("SELECT MAX(run_id) FROM results WHERE ? IS NULL OR run_id < ?",
+                             (run_id, run_id)).fetchone()
+    return row[0]
+
+
+def pass_rates(connection: sqlite3.Connection, run_id: str) -> list:
+    return connection.execute(f"""
+        SELECT deadline, assignment, COUNT(DISTINCT fork), SUM(passed), COUNT(*), AVG(passed)
+        FROM ({OUTCOMES})
+        WHERE run_id = ?
+        GROUP BY deadline, assignment
+        ORDER BY deadline, assignment""", (run_id,)).fetchall()
+
+
+def regressions(connection: sqlite3.Connection, old_run_id: str, new_run_id: str) -> list:
+    # tests a fork passed in the old run and no longer passes in the new one
+    return connection.execute(f"""
+        SELECT new.fork, new.assignment, new.test, old.commit_id, new.commit_id
+        FROM ({OUTCOMES}) AS old JOIN ({OUTCOMES}) AS new
+            ON old.fork = new.fork AND old.deadline IS new.deadline AND old.assignment IS new.assignment
+                AND old.test = new.test
+        WHERE old.run_id = ? AND new.run_id = ? AND old.passed AND NOT new.passed
+        ORDER BY new.fork, new.assignment, new.test""", (old_run_id, new_run_id)).fetchall()
+
+
+def flaky_tests(connection: sqlite3.Connection, min_runs: int) -> list:
+    # tests that both passed and failed on the same commit of a fork across runs. stored results are reused for
+    # unchanged commits, so this needs runs with AUTOGRADER_FORCE_REGRADE or local copies. a commit graded for
+    # several deadlines of a run has one outcome
+    return connection.execute(f"""
+        SELECT assignment, test, COUNT(*), GROUP_CONCAT(fork, ' ')
+        FROM (
+            SELECT fork, assignment, test, COUNT(*) AS runs, SUM(passed) AS passes
+            FROM (SELECT DISTINCT run_id, fork, commit_id, assignment, test, passed FROM ({OUTCOMES}))
+            GROUP BY fork, commit_id, assignment, test
+            HAVING runs >= ? AND passes > 0 AND passes < runs
+        )
+        GROUP BY assignment, test
+        ORDER BY COUNT(*) DESC, assignment, test""", (min_runs,)).fetchall()
+
+
+def query(args):
+    # the `python -m autograder results` commands
+    if not cfg.AUTOGRADER_RESULTS_DB_PATH.exists():
+        print(f"No results database at {cfg.AUTOGRADER_RESULTS_DB_PATH}", file=sys.stderr)
+        return
+    connection = connect()
+    try:
+        run_id = getattr(args, "run", None) or previous_run(connection)
+        if args.query == "runs":
+            for row in connection.execute("SELECT run_id, COUNT(DISTINCT fork), COUNT(*) FROM results "
+                                          "GROUP BY run_id ORDER BY run_id"):
+                print(f"{row[0]} {row[1]:>6} forks {row[2]:>8} results")
+        elif args.query == "pass-rates":
+            print(f"Run {run_id}")
+            for deadline, assignment, forks, passed, total, rate in pass_rates(connection, run_id):
+                print(f"{deadline or '':<10} {assignment or '?':<20} {forks:>6} forks {passed:>8} / {total:<8} "
+                      f"passed {rate:>7.1%}")
+        elif args.query == "regressions":
+            old_run_id = args.old_run or previous_run(connection, run_id)
+            print(f"Passed in {old_run_id}, not in {run_id}")
+            for fork, assignment, test, old_commit_id, new_commit_id in regressions(connection, old_run_id, run_id):
+                changed = "same commit" if old_commit_id == new_commit_id else f"now at {(new_commit_id or '?')[:8]}"
+                print(f"{fork:<45} {assignment or '?':<15} {test:<20} {changed}")
+        elif args.query == "flaky":
+            for assignment, test, forks, fork_names in flaky_tests(connection, args.min_runs):
+                print(f"{assignment or '?':<15} {test:<20} flaky for {forks} forks: {fork_names}")
+        elif args.query == "export-csv":
+            csv.writer(sys.stdout).writerows(csv_rows(connection, run_id, args.deadline))
+    finally:
+        connection.close()
@@ -0,0 +1,115 @@
+import functools
+import logging
+import math
+import pathlib
+import shutil
+import subprocess
+import time
+import uuid
+
+from autograder import cfg
+
+# student binaries run inside bubblewrap when it works on this machine: no network, nothing writable but the
+# test's own scratch directory and a private /tmp. every test gets cpu, memory and file size limits, from a
+# cgroup v2 when AUTOGRADER_CGROUP_PATH points to one delegated to us and from rlimits otherwise.
+# limits are applied by commands put in front of the binary rather than between fork and exec, which isn't safe
+# with the autograder's threads
+
+# moves itself into the cgroup given as $0 before running the command
+ENTER_CGROUP = 'echo $$ > "$0" && exec "$@"'
+
+
+@functools.lru_cache(maxsize=None)
+def bwrap_available() -> bool:
+    if cfg.AUTOGRADER_DISABLE_SANDBOX:
+        return False
+    if shutil.which("bwrap") is None:
+        logging.warning("bwrap not found, tests run without a sandbox")
+        return False
+    # e.g. containers that don't allow user namespaces
+    probe = subprocess.run(["bwrap", "--unshare-all", "--ro-bind", "/", "/", "true"], capture_output=True)
+    if probe.returncode != 0:
+        logging.warning(f"bwrap can't create a sandbox here, tests run without one: "
+                        f"{probe.stderr.decode().strip()}")
+        return False
+    return True
+
+
+class Sandbox:
+    # limits for one run of a student binary, the cgroup (if any) exists while the sandbox is entered
+
+    def __init__(self, run_path: pathlib.Path, timeout: float):
+        self.run_path = run_path
+        self.cgroup = None
+        # a single threaded program reaches the wall clock timeout first, so this only stops programs burning
+        # several cores
+        self.cpu_seconds = math.ceil(timeout) + 1
+        self.memory_bytes = cfg.AUTOGRADER_TEST_MEMORY_MB * 1024 * 1024
+        self.file_size_bytes = cfg.AUTOGRADER_TEST_MAX_FILE_MB * 1024 * 1024
+
+    def __enter__(self):
+        if cfg.AUTOGRADER_CGROUP_PATH:
+            self.cgroup = pathlib.Path(cfg.AUTOGRADER_CGROUP_PATH, f"test-{uuid.uuid4().hex}")
+            try:
+                self.cgroup.mkdir()
+                (self.cgroup / "memory.max").write_text(f"{cfg.AUTOGRADER_TEST_MEMORY_MB}M")
+                (self.cgroup / "memory.swap.max").write_text("0")
+                (self.cgroup / "pids.max").write_text(str(cfg.AUTOGRADER_TEST_MAX_PIDS))
+                (self.cgroup / "cpu.max").write_text("100000 100000")  # one core
+            except OSError as e:
+                logging.error(f"Could not set up cgroup {self.cgroup}, falling back to rlimits: {e}")
+                self._remove_cgroup()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.cgroup is not None:
+            self._remove_cgroup()
+        return False
+
+    def _remove_cgroup(self):
+        try:
+            # also gets whatever left the process group
+            (self.cgroup / "cgroup.kill").write_text("1")
+        except OSError:
+            pass
+        # the directory can only go once the killed processes have exited
+        for _ in range(50):
+            try:
+                self.cgroup.rmdir()
+                break
+            except FileNotFoundError:
+                break
+            except OSError:
+                time.sleep(0.01)
+        else:
+            logging.warning(f"Could not remove cgroup {self.cgroup}")
+        self.cgroup = None
+
+    def command(self, args: list) -> list:
+        return self._limits() + self._bwrap([str(arg) for arg in args])
+
+    def _limits(self) -> list:
+        limits = ["prlimit", f"--cpu={self.cpu_seconds}:{self.cpu_seconds + 1}", "--core=0",
+                  f"--fsize={self.file_size_bytes}"]
+        if self.cgroup is not None:
+            return ["sh", "-c", ENTER_CGROUP, str(self.cgroup / "cgroup.procs")] + limits + ["--"]
+        # counts address space rather than memory actually used, the cgroup limit is the accurate one. there is
+        # no rlimit fallback for the number of processes: RLIMIT_NPROC counts every process of the user,
+        # including the other tests and the autograder's own threads
+        return limits + [f"--as={self.memory_bytes}", "--"]
+
+    def _bwrap(self, args: list) -> list:
+        if not bwrap_available():
+            return args
+        binary = args[0]
+        run_path = str(self.run_path)
+        # later mounts go on top of earlier ones, so the scratch dir and binary stay visible under the new /tmp
+        return ["bwrap", "--unshare-all", "--die-with-parent", "--new-session",
+                "--ro-bind", "/", "/",
+                "--dev", "/dev",
+                "--proc", "/proc",
+                "--tmpfs", "/tmp",
+                "--ro-bind", binary, binary,
+                "--bind", run_path, run_path,
+                "--chdir", run_path,
+                "--"] + args
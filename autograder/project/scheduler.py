@@ -0,0 +1,35 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from autograder import cfg
+
+_executor = None
+_executor_lock = threading.Lock()
+_stages = {}
+
+
+def submit(fn, *args):
+    # a single pool shared by all forks, so a slow fork's tests spread over every core instead of one worker
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=cfg.AUTOGRADER_TEST_WORKERS, thread_name_prefix="test")
+        return _executor.submit(fn, *args)
+
+
+def stage(name: str) -> threading.BoundedSemaphore:
+    # caps how many threads are in a stage at once, whichever fork they work for: fetches mostly wait on the
+    # network and can be many, builds need a core each
+    with _executor_lock:
+        if name not in _stages:
+            limits = {"fetch": cfg.AUTOGRADER_FETCH_WORKERS, "build": cfg.AUTOGRADER_BUILD_WORKERS}
+            _stages[name] = threading.BoundedSemaphore(limits[name])
+        return _stages[name]
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -1,180 +1,331 @@
 import logging
-import re
-import subprocess
+import shutil
 import pathlib
-import os
-import signal
-import difflib
+import tempfile
+import threading
+import time
 
-from autograder import cfg
-from autograder.project.reporter import Reporter
+from autograder import cfg, timing
+from autograder.project import build_cache, execution, output_cache, sandbox, scheduler, test_suite
+from autograder.project.compare import PASS_THRESHOLD, jaccard_sets, ordered_tokens
+from autograder.project.reporter import Reporter, TestReport
 
 
-def ordered(actual: str, expected: str) -> float:
-    actual_lines = actual.split()
-    expected_lines = expected.split()
-    ratio = difflib.SequenceMatcher(isjunk=None, a=expected_lines, b=actual_lines, autojunk=False).ratio()
-    return ratio
+def decode_output(result: execution.RunResult) -> str:
+    try:
+        return result.output.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # the byte limit may have split the last character
+        if result.truncated and e.reason == "unexpected end of data":
+            return result.output[:e.start].decode('utf-8')
+        raise
 
 
-def jaccard(actual: str, expected: str) -> float:
-    actual_set = set(actual.split())
-    expected_set = set(expected.split())
-    intersection = actual_set.intersection(expected_set)
-    union = actual_set.union(expected_set)
-    return float(len(intersection) / len(union))
+def run_in_scratch_copy(assignment: test_suite.Assignment, test: test_suite.TestCase, binary: pathlib.Path,
+                        timeout: float, is_cancelled=None) -> execution.RunResult:
+    # tests running concurrently each get their own copy of the testcases, since mysh runs from there
+    with tempfile.TemporaryDirectory(prefix="autograder-") as scratch_dir:
+        run_path = pathlib.Path(scratch_dir, assignment.path.name)
+        shutil.copytree(assignment.path, run_path)
+        with timing.phase("run"), sandbox.Sandbox(run_path, timeout) as box:
+            return execution.run_bounded(box.command([binary]), run_path / test.input_path.name, run_path, timeout,
+                                         cfg.AUTOGRADER_MAX_OUTPUT_BYTES, is_cancelled)
+
+
+def output_score(test: test_suite.TestCase, output: str) -> tuple:
+    # the best score against the expected outputs and the name of the one that gave it, stops at the first one
+    # that passes
+    best_score = 0.0
+    best_variant = None
+    # the same type as the expected tokens, so that identical outputs compare equal
+    output_tokens = tuple(output.split())
+    output_set = None
+    for expected_output in test.expected_outputs:
+        if test.order_matters:
+            score = ordered_tokens(output_tokens, expected_output.tokens)
+        else:
+            if output_set is None:
+                output_set = set(output_tokens)
+            score = jaccard_sets(output_set, expected_output.token_set)
+
+        if best_variant is None or score > best_score:
+            best_score, best_variant = score, expected_output.name
+        if score >= PASS_THRESHOLD:
+            break
+    return best_score, best_variant
+
+
+def cached_output_score(fork: str, assignment: test_suite.Assignment, test: test_suite.TestCase,
+                        output: str) -> tuple:
+    # an output another fork already printed for the test isn't scored again
+    entry_key = output_cache.key(f"{assignment.name}/{test.name}", output)
+    cached = output_cache.get(entry_key, fork)
+    if cached is not None:
+        return cached
+    score, variant = output_score(test, output)
+    output_cache.put(entry_key, fork, score, variant)
+    return score, variant
+
+
+def calibrate_timeouts(suite: test_suite.TestSuite, base_repo_path: pathlib.Path,
+                       base_commit_id: str) -> test_suite.TestSuite:
+    # every test the base repo's shell passes may run for a multiple of how long that took
+    futures = {}
+    for assignment in suite.assignments:
+        for test in assignment.tests:
+            futures[assignment.name, test.name] = scheduler.submit(reference_runtime, base_repo_path, base_commit_id,
+                                                                   assignment, test)
+
+    assignments = []
+    num_calibrated = 0
+    for assignment in suite.assignments:
+        tests = []
+        for test in assignment.tests:
+            runtime = futures[assignment.name, test.name].result()
+            if runtime is not None:
+                timeout = runtime * cfg.AUTOGRADER_RUN_TIMEOUT_MULTIPLIER
+                timeout = min(cfg.AUTOGRADER_MAX_RUN_TIMEOUT, max(cfg.AUTOGRADER_MIN_RUN_TIMEOUT, timeout))
+                logging.debug(f"{assignment.name} {test.name} takes {runtime:.3f}s on the base repo, "
+                              f"timeout {timeout:.1f}s")
+                test = test._replace(timeout=timeout)
+                num_calibrated += 1
+            tests.append(test)
+        assignments.append(assignment._replace(tests=tuple(tests)))
+
+    logging.info(f"Calibrated run timeouts of {num_calibrated} tests from the base repo")
+    return test_suite.TestSuite(tuple(assignments))
+
+
+def reference_runtime(base_repo_path: pathlib.Path, base_commit_id: str, assignment: test_suite.Assignment,
+                      test: test_suite.TestCase):
+    # None when the base repo's shell can't be built or doesn't pass the test
+    try:
+        binary = build_cache.build(pathlib.Path(base_repo_path, "src"), base_commit_id, test.frame_store_size,
+                                   test.var_store_size)
+    except build_cache.BuildError:
+        return None
+    with timing.phase("calibrate", test=f"{assignment.name}/{test.name}"):
+        start = time.perf_counter()
+        result = run_in_scratch_copy(assignment, test, binary, cfg.AUTOGRADER_MAX_RUN_TIMEOUT)
+        runtime = time.perf_counter() - start
+    if result.timed_out or result.truncated or result.returncode != 0:
+        return None
+    try:
+        if output_score(test, result.output.decode('utf-8'))[0] >= PASS_THRESHOLD:
+            return runtime
+    except UnicodeError:
+        pass
+    return None
+
+
+class FailFast:
+    # the tests of one assignment of one fork, in order. once `limit` tests in a row timed out, crashed or were
+    # skipped, the tests after them are skipped. run_all applies that rule when it merges the results, so grades
+    # don't depend on which tests finished first. this only saves the time of tests that will be skipped anyway:
+    # they aren't started, or are stopped if they are already running. it must never skip a test that run_all
+    # wouldn't
+
+    def __init__(self, num_tests: int, limit: int):
+        self.limit = limit
+        self.broken = [None] * num_tests
+        self.lock = threading.Lock()
+
+    def record(self, index: int, broken: bool):
+        with self.lock:
+            # a RUN_MULTIPLE test is broken if any of its runs was
+            self.broken[index] = bool(self.broken[index]) or broken
+
+    def should_skip(self, index: int) -> bool:
+        if self.limit <= 0 or index < self.limit:
+            return False
+        with self.lock:
+            return all(self.broken[index - self.limit:index])
+
+
+class MultipleRuns:
+    # the runs of a RUN_MULTIPLE test, runs after the first failing one are skipped or stopped
+
+    def __init__(self, iterations: int):
+        self.iterations = iterations
+        self.futures = []
+        self.first_failure = None
+        self.lock = threading.Lock()
+
+    def fail(self, i: int):
+        with self.lock:
+            if self.first_failure is None or i < self.first_failure:
+                self.first_failure = i
+
+    def is_cancelled(self, i: int) -> bool:
+        with self.lock:
+            return self.first_failure is not None and i > self.first_failure
+
+    def result(self):
+        # same outcome as running one after another: the first failing run is reported, every run up to it
+        # gets its result. runs are only skipped after a failure, so this loop stops before reaching them
+        results = []
+        for i, future in enumerate(self.futures, start=1):
+            passed, test_report = future.result()
+            results.extend(test_report.results)
+            if not passed:
+                if not test_report.skipped:
+                    test_report.append_same_line(f"on run {i} out of {self.iterations}")
+                break
+        test_report.results = results
+        return passed, test_report
 
 
 class TestRunner:
     rep: Reporter
     project_path: pathlib.Path
+    commit_id: str
+    suite: test_suite.TestSuite
 
-    def __init__(self, project_identifier: str, project_location: pathlib.Path):
+    def __init__(self, project_identifier: str, project_location: pathlib.Path, commit_id: str,
+                 suite: test_suite.TestSuite):
         self.rep = Reporter.get_reporter(project_identifier)
         self.project_path = project_location
+        self.commit_id = commit_id
+        self.suite = suite
 
     def run_all(self):
         self.rep.append("\nTEST CASES")
 
-        assignments = cfg.AUTOGRADER_BASE_REPO_CLONE_PATH.glob("testcases/*")
-        for assignment_path in assignments:
-            assignment_name = assignment_path.stem
-            self.rep.append(assignment_name)
+        # every test is handed to the shared scheduler first, results are then merged in a fixed order
+        scheduled = []
+        for assignment in self.suite.assignments:
+            futures = []
+            fail_fast = FailFast(len(assignment.tests), cfg.AUTOGRADER_FAIL_FAST_AFTER)
+            for index, test in enumerate(assignment.tests):
+                if test.run_multiple:
+                    futures.append(self.schedule_multiple(assignment, test, fail_fast, index))
+                else:
+                    futures.append(scheduler.submit(self.run_scheduled_test, assignment, test, fail_fast, index))
+            scheduled.append((assignment, futures))
 
-            test_result_files = assignment_path.glob("*_result.txt")
-            test_names = map(lambda f: f.stem.replace("_result", ""), test_result_files)
+        for assignment, futures in scheduled:
+            self.rep.append(assignment.name)
             num_tests = 0
             num_passed = 0
-            for test in test_names:
+            broken_in_a_row = 0
+            for test, future in zip(assignment.tests, futures):
                 num_tests += 1
-
-                order_matters = False
-                if assignment_name in cfg.ORDER_MATTERS:
-                    order_matters = test in cfg.ORDER_MATTERS[assignment_name]
-
-                run_multiple = False
-                if assignment_name in cfg.RUN_MULTIPLE:
-                    run_multiple = test in cfg.RUN_MULTIPLE[assignment_name]
-
-                passed = False
-                if run_multiple:
-                    iterations = cfg.AUTOGRADER_MT_ITERATIONS
-                    i = 1
-                    while i <= iterations:
-                        self.rep.enable_per_test_buffer()  # need to reset the temp buffer on every run
-                        passed = self.run_test(test, assignment_path, order_matters)
-                        if not passed:
-                            break
-                        i += 1
-
-                    if not passed:
-                        self.rep.append_same_line(f"on run {i} out of {iterations}")
-
-                    self.rep.flush_per_test_buffer()
-                else:
-                    passed = self.run_test(test, assignment_path, order_matters)
-
+                passed, test_report = future.result()
+                if 0 < cfg.AUTOGRADER_FAIL_FAST_AFTER <= broken_in_a_row:
+                    # even if it ran before the tests in front of it were done
+                    passed = False
+                    test_report = TestReport(self.rep.project_name)
+                    test_report.skip(test.name)
+                broken_in_a_row = broken_in_a_row + 1 if test_report.broken else 0
+                self.rep.merge(test_report, assignment.name)
                 if passed:
                     num_passed += 1
 
             self.rep.append(f"Passed {num_passed} / {num_tests}")
-            self.rep.append(f"{assignment_name} score {num_passed/num_tests:.0%}\n")
+            self.rep.append(f"{assignment.name} score {num_passed/num_tests:.0%}\n")
+
+    def run_scheduled_test(self, assignment: test_suite.Assignment, test: test_suite.TestCase,
+                           fail_fast: FailFast, index: int):
+        test_report = TestReport(self.rep.project_name)
+        passed = False
+        if fail_fast.should_skip(index):
+            test_report.skip(test.name)
+        else:
+            passed = self.run_test(assignment, test, test_report, lambda: fail_fast.should_skip(index))
+            if test_report.cancelled:
+                test_report.skip(test.name)
+        fail_fast.record(index, test_report.broken)
+        return passed, test_report
 
-    def run_test(self, test: str, assignment_path: pathlib.Path, order_matters: bool):
+    def schedule_multiple(self, assignment: test_suite.Assignment, test: test_suite.TestCase, fail_fast: FailFast,
+                          index: int):
+        # every run is its own work item, they share one build through the build cache
+        runs = MultipleRuns(cfg.AUTOGRADER_MT_ITERATIONS)
+        for i in range(1, runs.iterations + 1):
+            runs.futures.append(scheduler.submit(self.run_iteration, assignment, test, runs, i, fail_fast, index))
+        return runs
+
+    def run_iteration(self, assignment: test_suite.Assignment, test: test_suite.TestCase, runs: MultipleRuns,
+                      i: int, fail_fast: FailFast, index: int):
+        if runs.is_cancelled(i):
+            return None
+        test_report = TestReport(self.rep.project_name)
+        passed = False
+        if fail_fast.should_skip(index):
+            test_report.skip(test.name)
+        else:
+            passed = self.run_test(assignment, test, test_report,
+                                   lambda: runs.is_cancelled(i) or fail_fast.should_skip(index))
+            # runs stopped because an earlier run failed are never reported
+            if test_report.cancelled and fail_fast.should_skip(index):
+                test_report.skip(test.name)
+        # the test is broken if its first failing run is, which is only known for sure of the first run
+        fail_fast.record(index, test_report.broken and i == 1)
+        if not passed:
+            runs.fail(i)
+        return passed, test_report
+
+    def run_test(self, assignment: test_suite.Assignment, test: test_suite.TestCase, rep: TestReport,
+                 is_cancelled=None):
+        with timing.phase("test", self.rep.project_name, f"{assignment.name}/{test.name}"):
+            return self._run_test(assignment, test, rep, is_cancelled)
+
+    def _run_test(self, assignment: test_suite.Assignment, test: test_suite.TestCase, rep: TestReport,
+                  is_cancelled=None):
         binary_path = pathlib.Path(self.project_path, "src")
-        test_input_path = pathlib.Path(assignment_path, f"{test}.txt")
-
-        a3_frame_store_sz = 18
-        a3_var_store_sz = 10
-        if assignment_path.stem == "assignment3":
-            expected_output_path = pathlib.Path(assignment_path, f"{test}_result.txt")
-            with open(expected_output_path, 'r') as expected_output:
-                expected_output_str = expected_output.read()
-                mem_sizes = re.findall(r'(?<=Size = )(\d+)', expected_output_str)
-                if len(mem_sizes) == 2:
-                    a3_frame_store_sz, a3_var_store_sz = mem_sizes
-                    logging.debug(f"parsed framestore={a3_frame_store_sz} varstore={a3_var_store_sz}")
-
-        timed_out = False
         try:
-            completed_make_clean = subprocess.run(["make", "clean"],
-                                                  timeout=15, cwd=binary_path, capture_output=cfg.CAPTURE_OUTPUT)
-            if completed_make_clean.returncode != 0:
-                self.rep.append(f"# {test:<25} 'make clean' failed (return code {completed_make_clean.returncode})")
-                return False
-        except Exception as e:
-            self.rep.append(f"# {test:<25} 'make clean' failed ({e.__class__.__name__})")
+            binary = build_cache.build(binary_path, self.commit_id, test.frame_store_size, test.var_store_size)
+        except build_cache.BuildError as e:
+            rep.build_failed(test.name, e)
             return False
+        return self.run_binary(assignment, test, binary, rep, is_cancelled)
 
+    def run_binary(self, assignment: test_suite.Assignment, test: test_suite.TestCase, binary: pathlib.Path,
+                   rep: TestReport, is_cancelled=None):
+        # actually run the test
         try:
-            completed_make = subprocess.run(cfg.autograder_make_command_line(a3_frame_store_sz, a3_var_store_sz),
-                                            timeout=15, cwd=binary_path, capture_output=cfg.CAPTURE_OUTPUT)
-
-            if completed_make.returncode != 0:
-                self.rep.append(f"# {test:<25} 'make' failed (return code {completed_make.returncode})")
-                return False
-        except Exception as e:
-            self.rep.append(f"# {test:<25} 'make' failed ({e.__class__.__name__})")
+            start = time.perf_counter()
+            result = run_in_scratch_copy(assignment, test, binary, test.timeout, is_cancelled)
+            duration = time.perf_counter() - start
+        except OSError as e:
+            logging.error(f"For {self.project_path} could not run {test.name}: {e}")
+            rep.fail(test.name)
             return False
 
-        # actually run the test
-        bubblewrap_string = ""
-        # if shutil.which("bwrap"):
-        #     bubblewrap_string = f"bwrap --unshare-all --ro-bind / / --dev-bind {binary_path} {binary_path} "
-        process = subprocess.Popen(f"{bubblewrap_string}{binary_path}/mysh < {test_input_path}",
-                                   shell=True,
-                                   cwd=assignment_path,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE,
-                                   start_new_session=True)  # crucial to ensure spawned processes die
-        # https://alexandra-zaharia.github.io/posts/kill-subprocess-and-its-children-on-timeout-python/
-
-        try:
-            process.wait(timeout=15)
-            output = process.stdout
-            if process.returncode != 0:
-                self.rep.exit_code(test, process.returncode)
-                return False
-        except subprocess.TimeoutExpired as e:
-            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-            timed_out = True
-            if e.output:
-                output = e.output
-            else:
-                self.rep.timeout(test)
-                return False
+        if result.cancelled:
+            rep.cancelled = True
+            return False
+        rep.record_run(test.name, duration=round(duration, 3), exit_code=result.returncode,
+                       cpu_time=round(result.cpu_time, 3), max_rss_kb=result.max_rss_kb)
+        if result.timed_out:
+            rep.timeout(test.name)
+            return False
+        if result.returncode != 0 and not result.truncated:
+            rep.exit_code(test.name, result.returncode)
+            return False
 
         # handling weird unicode error thing
-        if output:
-            try:
-                output = output.read().decode('utf-8')
-                self.rep.add_output(test, output)
-                if cfg.DEBUG:
-                    output_file_path = f"{cfg.AUTOGRADER_WORKING_DIR}/{self.rep.project_name.split('/')[0]}_{assignment_path.stem}_{test}.txt"
-                    with open(output_file_path, 'w') as f:
-                        f.writelines(output)
-            except UnicodeError:
-                logging.info(f"For {self.project_path} error decoding output on {test}")
-                self.rep.fail(test)
-                return False
+        try:
+            output = decode_output(result)
+            rep.add_output(test.name, output)
+            if cfg.DEBUG:
+                output_file_path = f"{cfg.AUTOGRADER_WORKING_DIR}/{rep.project_name.split('/')[0]}_{assignment.name}_{test.name}.txt"
+                with open(output_file_path, 'w') as f:
+                    f.writelines(output)
+        except UnicodeError:
+            logging.info(f"For {self.project_path} error decoding output on {test.name}")
+            rep.fail(test.name)
+            return False
 
         # comparing outputs
-        possible_results = assignment_path.glob(f"{test}_result*.txt")
-        for possible_result in possible_results:
-            with open(possible_result, 'r') as expected_output:
-                expected_output_str = expected_output.read()
-                if order_matters:
-                    score = ordered(output, expected_output_str)
-                else:
-                    score = jaccard(output, expected_output_str)
-
-                if score >= 0.9:
-                    self.rep.succeed(test)
-                    return True
-
-        if timed_out:
-            self.rep.timeout(test)
-            return False
+        with timing.phase("compare"):
+            score, _ = cached_output_score(self.rep.project_name, assignment, test, output)
+        rep.record_run(test.name, score=round(score, 4))
+        if score >= PASS_THRESHOLD:
+            rep.succeed(test.name)
+            return True
 
-        self.rep.fail(test)
+        rep.fail(test.name)
+        if result.truncated:
+            rep.append_same_line(f"(output cut off after {cfg.AUTOGRADER_MAX_OUTPUT_BYTES} bytes)")
         return False
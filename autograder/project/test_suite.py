@@ -0,0 +1,76 @@
+import logging
+import pathlib
+import re
+import typing
+
+from autograder import cfg
+
+DEFAULT_FRAME_STORE_SIZE = 18
+DEFAULT_VAR_STORE_SIZE = 10
+
+
+class ExpectedOutput(typing.NamedTuple):
+    tokens: tuple
+    token_set: frozenset
+    # file name of the variant, e.g. T_t1_result2.txt
+    name: str
+
+
+class TestCase(typing.NamedTuple):
+    name: str
+    input_path: pathlib.Path
+    expected_outputs: tuple
+    frame_store_size: int
+    var_store_size: int
+    order_matters: bool
+    run_multiple: bool
+    # seconds, see test_runner.calibrate_timeouts
+    timeout: float
+
+
+class Assignment(typing.NamedTuple):
+    name: str
+    path: pathlib.Path
+    tests: tuple
+
+
+# built once per run from the base repo and shared read-only by every worker
+class TestSuite(typing.NamedTuple):
+    assignments: tuple
+
+
+def load(base_repo_path: pathlib.Path) -> TestSuite:
+    assignments = []
+    for assignment_path in sorted(base_repo_path.glob("testcases/*")):
+        assignment_name = assignment_path.stem
+        test_names = sorted(f.stem.replace("_result", "") for f in assignment_path.glob("*_result.txt"))
+        tests = tuple(_load_test(assignment_path, assignment_name, test) for test in test_names)
+        assignments.append(Assignment(assignment_name, assignment_path, tests))
+
+    suite = TestSuite(tuple(assignments))
+    logging.info(f"Loaded {sum(len(a.tests) for a in suite.assignments)} tests "
+                 f"from {len(suite.assignments)} assignments")
+    return suite
+
+
+def _load_test(assignment_path: pathlib.Path, assignment_name: str, test: str) -> TestCase:
+    expected_outputs = []
+    for possible_result in sorted(assignment_path.glob(f"{test}_result*.txt")):
+        with open(possible_result, 'r') as expected_output:
+            tokens = tuple(expected_output.read().split())
+        expected_outputs.append(ExpectedOutput(tokens, frozenset(tokens), possible_result.name))
+
+    frame_store_size = DEFAULT_FRAME_STORE_SIZE
+    var_store_size = DEFAULT_VAR_STORE_SIZE
+    if assignment_name == "assignment3":
+        with open(pathlib.Path(assignment_path, f"{test}_result.txt"), 'r') as expected_output:
+            mem_sizes = re.findall(r'(?<=Size = )(\d+)', expected_output.read())
+        if len(mem_sizes) == 2:
+            frame_store_size, var_store_size = map(int, mem_sizes)
+            logging.debug(f"parsed framestore={frame_store_size} varstore={var_store_size} for {test}")
+
+    order_matters = test in cfg.ORDER_MATTERS.get(assignment_name, [])
+    run_multiple = test in cfg.RUN_MULTIPLE.get(assignment_name, [])
+
+    return TestCase(test, pathlib.Path(assignment_path, f"{test}.txt"), tuple(expected_outputs),
+                    frame_store_size, var_store_size, order_matters, run_multiple, cfg.AUTOGRADER_MAX_RUN_TIMEOUT)
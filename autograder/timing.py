@@ -0,0 +1,126 @@
+import json
+import logging
+import pathlib
+import threading
+import time
+
+# wall and cpu time per fork, phase and test. every measurement is written as a json line to
+# timings_<run>.jsonl next to autograder.log, and summarized at the end of the run
+
+SUMMARY_SIZE = 5
+
+_lock = threading.Lock()
+_local = threading.local()
+_timings_file = None
+_run_id = None
+_records = []
+
+
+class Timer:
+    def __init__(self, phase: str, fork=None, test=None):
+        self.phase = phase
+        self.fork = fork
+        self.test = test
+        self.child_user = 0.0
+        self.child_sys = 0.0
+        self.child_maxrss_kb = 0
+
+    def __enter__(self):
+        # phases opened further down the call stack belong to the same fork and test
+        stack = _stack()
+        if stack:
+            self.fork = self.fork or stack[-1].fork
+            self.test = self.test or stack[-1].test
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _stack().remove(self)
+        record = {
+            "run": _run_id,
+            "fork": self.fork,
+            "phase": self.phase,
+            "test": self.test,
+            "wall": round(time.perf_counter() - self._wall_start, 6),
+            "cpu": round(time.thread_time() - self._cpu_start, 6),
+            "child_user": round(self.child_user, 6),
+            "child_sys": round(self.child_sys, 6),
+            "child_maxrss_kb": self.child_maxrss_kb,
+        }
+        with _lock:
+            _records.append((self.phase, self.fork, self.test, record["wall"]))
+            if _timings_file is not None:
+                _timings_file.write(json.dumps(record) + "\n")
+        return False
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def phase(name: str, fork=None, test=None) -> Timer:
+    return Timer(name, fork, test)
+
+
+def add_child_usage(rusage):
+    # children are accounted to every phase open on the thread that waited for them
+    for timer in _stack():
+        timer.child_user += rusage.ru_utime
+        timer.child_sys += rusage.ru_stime
+        timer.child_maxrss_kb = max(timer.child_maxrss_kb, rusage.ru_maxrss)
+
+
+def start(working_dir: str, run_id: str):
+    global _timings_file, _run_id
+    with _lock:
+        _run_id = run_id
+        _records.clear()
+        _timings_file = open(pathlib.Path(working_dir, f"timings_{run_id}.jsonl"), 'w', buffering=1)
+
+
+def stop():
+    global _timings_file
+    with _lock:
+        if _timings_file is not None:
+            _timings_file.close()
+            _timings_file = None
+
+
+def percentile(values, fraction: float) -> float:
+    ordered_values = sorted(values)
+    index = max(0, min(len(ordered_values) - 1, round(fraction * len(ordered_values)) - 1))
+    return ordered_values[index]
+
+
+def summary() -> list:
+    with _lock:
+        records = list(_records)
+
+    lines = ["Run summary"]
+    forks = sorted((r for r in records if r[0] == "fork"), key=lambda r: r[3], reverse=True)
+    lines.append("Slowest forks:")
+    for _, fork, _, wall in forks[:SUMMARY_SIZE]:
+        lines.append(f"  {fork:<45} {wall:8.2f}s")
+
+    tests = sorted((r for r in records if r[0] == "test"), key=lambda r: r[3], reverse=True)
+    lines.append("Slowest tests:")
+    for _, fork, test, wall in tests[:SUMMARY_SIZE]:
+        lines.append(f"  {fork:<45} {test:<20} {wall:8.2f}s")
+
+    lines.append(f"  {'phase':<20} {'count':>7} {'total':>10} {'p50':>8} {'p95':>8}")
+    phases = {}
+    for phase_name, _, _, wall in records:
+        phases.setdefault(phase_name, []).append(wall)
+    for phase_name, walls in sorted(phases.items()):
+        lines.append(f"  {phase_name:<20} {len(walls):>7} {sum(walls):>9.1f}s "
+                     f"{percentile(walls, 0.5):>7.2f}s {percentile(walls, 0.95):>7.2f}s")
+    return lines
+
+
+def log_summary():
+    for line in summary():
+        logging.info(line)
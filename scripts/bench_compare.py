@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+# compares the output comparator against plain difflib on typical and runaway outputs
+# usage: python3 scripts/bench_compare.py
+
+import difflib
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / ".."))
+
+from autograder.project.compare import PASS_THRESHOLD, ordered  # noqa: E402
+
+
+def difflib_ordered(actual: str, expected: str) -> float:
+    return difflib.SequenceMatcher(isjunk=None, a=expected.split(), b=actual.split(), autojunk=False).ratio()
+
+
+random.seed(310)
+words = [f"word{i}" for i in range(200)] + ["$", "Variable", "does", "not", "exist", "set", "print", "echo"]
+expected = " ".join(random.choice(words) for _ in range(400))
+
+cases = {
+    "identical": expected,
+    "small diff": " ".join(expected.split()[5:] + ["extra"]),
+    "reordered": " ".join(sorted(expected.split())),
+    "runaway loop": (expected + " ") * 50,
+    "prompt spam": expected + " $" * 20000,
+    "wrong output": " ".join(random.choice(words) for _ in range(400)),
+}
+
+for name, actual in cases.items():
+    old_pass = difflib_ordered(actual, expected) >= PASS_THRESHOLD
+    new_pass = ordered(actual, expected) >= PASS_THRESHOLD
+    if old_pass != new_pass:
+        print(f"{name}: decisions differ (difflib {old_pass}, ordered {new_pass})")
+        sys.exit(1)
+
+    number = 3
+    old_time = timeit.timeit(lambda: difflib_ordered(actual, expected), number=number) / number
+    new_time = timeit.timeit(lambda: ordered(actual, expected), number=number) / number
+    print(f"{name:<15} pass={new_pass!s:<5} difflib {old_time * 1000:9.2f} ms   "
+          f"ordered {new_time * 1000:9.2f} ms   speedup {old_time / new_time:8.1f}x")
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# grades synthetic forks end to end to measure autograder throughput, without gitlab or mailjet
+# usage: python3 scripts/benchmark.py [--forks 24] [--variants correct,segfault] [--save results.json]
+#                                     [--baseline results.json]
+
+import argparse
+import http.server
+import json
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent / ".."))
+
+from autograder import cfg  # noqa: E402
+
+BASE_REPO = "balmau/comp310-winter23"
+
+MAKEFILE = """CC=gcc
+framesize=18
+varmemsize=10
+mysh: shell.c
+\t$(CC) -O2 -D FRAMESIZE=$(framesize) -D VARMEMSIZE=$(varmemsize) -o mysh shell.c
+clean:
+\trm -f mysh
+"""
+
+# echoes its input like the reference shell would, assignment3 tests expect the memory sizes first.
+# each variant replaces ECHO_LINE, the fork name keeps commits (and so build cache entries) distinct
+SHELL_C = """// FORK
+#include <stdio.h>
+#include <string.h>
+#include <ctype.h>
+EXTRA_CODE
+int main(void) {
+  char line[1024];
+  int first = 1;
+  while (fgets(line, sizeof line, stdin)) {
+    if (first && strncmp(line, "exec", 4) == 0)
+      printf("Frame Store Size = %d; Variable Store Size = %d\\n", FRAMESIZE, VARMEMSIZE);
+    first = 0;
+    ECHO_LINE
+  }
+  return 0;
+}
+"""
+
+VARIANTS = {
+    "correct": "fputs(line, stdout);",
+    "wrong-output": "for (char *c = line; *c; c++) putchar(toupper(*c));",
+    "segfault": "if (strstr(line, \"crash\")) *(volatile int *)0 = 0; fputs(line, stdout);",
+    "infinite-loop": "if (strstr(line, \"loop\")) for (;;); fputs(line, stdout);",
+    "huge-output": "if (strstr(line, \"loop\")) for (;;) fputs(\"$ \", stdout); fputs(line, stdout);",
+    "slow-compile": "fputs(line, stdout); unused_0(first);",
+}
+
+# enough generated code to keep gcc -O2 busy for a couple of seconds, well within the 5s compile check
+SLOW_COMPILE_FUNCTIONS = 500
+
+
+def git_commit(path: pathlib.Path):
+    for command in (["git", "init", "-q", "-b", "main"], ["git", "add", "-A"],
+                    ["git", "-c", "user.email=bench@localhost", "-c", "user.name=bench", "commit", "-qm", "bench"]):
+        subprocess.run(command, cwd=path, check=True)
+
+
+def make_base_repo(working_dir: pathlib.Path, tests_per_assignment: int):
+    # same layout as the course repo: testcases/<assignment>/<test>.txt and <test>_result.txt
+    base = working_dir / "repos" / BASE_REPO
+    # a working shell, the run timeouts are calibrated against it
+    write_shell(base / "src", BASE_REPO, "correct")
+    tests = {"assignment1": {}, "assignment2": {}, "assignment3": {}}
+    for i in range(1, tests_per_assignment + 1):
+        tests["assignment1"][f"T_t{i}"] = f"echo hello{i}\nset x {i}\nprint x\n"
+    tests["assignment1"]["T_crash"] = "echo crash\n"
+    tests["assignment1"]["T_loop"] = "echo loop\n"
+    tests["assignment2"]["T_FCFS"] = "run a\nrun b\nrun c\n"  # order matters
+    tests["assignment2"]["T_MT1"] = "exec a b c\nrun a\n"  # run several times
+    for i in range(1, tests_per_assignment + 1):
+        tests["assignment2"][f"T_sched{i}"] = f"run p{i}\nrun q{i}\n"
+
+    for i in range(1, tests_per_assignment + 1):
+        tests["assignment3"][f"T_mem{i}"] = f"exec prog{i}\n"
+
+    for assignment, assignment_tests in tests.items():
+        path = base / "testcases" / assignment
+        path.mkdir(parents=True)
+        for i, (test, test_input) in enumerate(assignment_tests.items(), start=1):
+            (path / f"{test}.txt").write_text(test_input)
+            expected = test_input
+            if test_input.startswith("exec"):
+                # assignment3 tests ask for other memory sizes every other test, so forks build twice
+                frame_sz, var_sz = (21, 100) if assignment == "assignment3" and i % 2 == 0 else (18, 10)
+                expected = f"Frame Store Size = {frame_sz}; Variable Store Size = {var_sz}\n" + test_input
+            (path / f"{test}_result.txt").write_text(expected)
+    git_commit(base)
+
+
+def make_fork(working_dir: pathlib.Path, project: str, variant: str):
+    write_shell(working_dir / "repos" / project / "src", project, variant)
+    git_commit(working_dir / "repos" / project)
+
+
+def write_shell(src: pathlib.Path, project: str, variant: str):
+    src.mkdir(parents=True)
+    extra_code = ""
+    if variant == "slow-compile":
+        extra_code = "\n".join(f"int unused_{i}(int x) {{ return x * {i} + unused_{i + 1}(x - 1); }}"
+                               for i in range(SLOW_COMPILE_FUNCTIONS))
+        extra_code = (f"int unused_{SLOW_COMPILE_FUNCTIONS}(int x) {{ return x; }}\n"
+                      + "\n".join(f"int unused_{i}(int x);" for i in range(SLOW_COMPILE_FUNCTIONS)) + "\n"
+                      + extra_code)
+    (src / "Makefile").write_text(MAKEFILE)
+    shell_c = SHELL_C.replace("FORK", project).replace("EXTRA_CODE", extra_code)
+    (src / "shell.c").write_text(shell_c.replace("ECHO_LINE", VARIANTS[variant]))
+
+
+class _MailjetStub(http.server.BaseHTTPRequestHandler):
+    # accepts every batch, so the mailer's cost is measured without sending anything
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        response = json.dumps({"Messages": [{"Status": "success"} for _ in body["Messages"]]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(working_dir: pathlib.Path, forks: dict, mt_iterations: int) -> dict:
+    mail_server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _MailjetStub)
+    threading.Thread(target=mail_server.serve_forever, daemon=True).start()
+
+    cfg.load(AUTOGRADER_WORKING_DIR=str(working_dir),
+             AUTOGRADER_USE_LOCAL_COPY=True,
+             AUTOGRADER_TARGET_ONLY=None,
+             AUTOGRADER_MT_ITERATIONS=mt_iterations,
+             AUTOGRADER_BUILD_CACHE_PATH=working_dir / "build_cache",
+             MJ_API_URL=f"http://127.0.0.1:{mail_server.server_port}/",
+             MJ_USERNAME="bench",
+             MJ_PASSWORD="bench",
+             DEBUG=False,
+             CAPTURE_OUTPUT=True)
+    cfg.override(FORKS=forks)
+
+    from autograder import autograder
+    start = time.perf_counter()
+    autograder.Autograder().main()
+    elapsed = time.perf_counter() - start
+    mail_server.shutdown()
+
+    tests_run = 0
+    for timings_file in working_dir.glob("timings_*.jsonl"):
+        with open(timings_file) as f:
+            tests_run += sum(1 for line in f if json.loads(line)["phase"] == "test")
+
+    # ru_maxrss is in kilobytes on linux, for children it is the largest single child
+    return {
+        "forks": len(forks),
+        "tests": tests_run,
+        "seconds": round(elapsed, 2),
+        "forks_per_minute": round(len(forks) / elapsed * 60, 2),
+        "tests_per_second": round(tests_run / elapsed, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grades synthetic forks end to end to measure autograder "
+                                                 "throughput.")
+    parser.add_argument("--forks", type=int, default=24)
+    parser.add_argument("--variants", default=",".join(VARIANTS),
+                        help="comma separated, forks cycle through them (default: all)")
+    parser.add_argument("--tests-per-assignment", type=int, default=4)
+    parser.add_argument("--mt-iterations", type=int, default=10)
+    parser.add_argument("--working-dir", type=pathlib.Path,
+                        help="must not exist yet, kept after the run (default: a temporary directory)")
+    parser.add_argument("--save", type=pathlib.Path, help="write the results as json")
+    parser.add_argument("--baseline", type=pathlib.Path, help="results saved by an earlier run to compare against")
+    args = parser.parse_args()
+
+    variants = args.variants.split(",")
+    for variant in variants:
+        if variant not in VARIANTS:
+            parser.error(f"unknown variant {variant}, expected one of {', '.join(VARIANTS)}")
+    if args.working_dir and args.working_dir.exists():
+        parser.error(f"{args.working_dir} already exists, its build cache would skew the results")
+
+    with tempfile.TemporaryDirectory(prefix="autograder-bench-") as tmp_dir:
+        working_dir = args.working_dir or pathlib.Path(tmp_dir)
+        make_base_repo(working_dir, args.tests_per_assignment)
+        forks = {}
+        for i in range(args.forks):
+            project = f"bench{i:03}/comp310-winter23"
+            make_fork(working_dir, project, variants[i % len(variants)])
+            forks[project] = [f"bench{i:03}@localhost"]
+
+        results = run(working_dir, forks, args.mt_iterations)
+
+    for name, value in results.items():
+        print(f"{name:<20} {value:>10}")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        print(f"forks/minute {results['forks_per_minute'] / baseline['forks_per_minute']:.2f}x baseline, "
+              f"tests/second {results['tests_per_second'] / baseline['tests_per_second']:.2f}x baseline")
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import pytest
+
+from autograder import cfg
+from autograder.distributed import JobQueue
+
+
+@pytest.fixture(autouse=True)
+def max_attempts():
+    cfg.load(AUTOGRADER_MAX_ATTEMPTS=3)
+
+
+def test_completed_projects_finish_the_run():
+    jobs = JobQueue(["a/p", "b/p"])
+    for _ in range(2):
+        project = jobs.take()
+        assert jobs.claim(project)
+        jobs.complete(project)
+    assert jobs.finished.is_set()
+
+
+def test_ended_lease_hands_the_project_out_again():
+    jobs = JobQueue(["a/p"])
+    assert jobs.take() == "a/p"
+    jobs.requeue("a/p")
+    assert jobs.take() == "a/p"
+    assert not jobs.finished.is_set()
+
+
+def test_gives_up_after_max_attempts_even_if_every_worker_hung():
+    # every lease expires without its worker disconnecting
+    jobs = JobQueue(["a/p"])
+    for _ in range(3):
+        assert jobs.take() == "a/p"
+        jobs.requeue("a/p")
+    assert jobs.take() is None
+    assert jobs.finished.is_set()
+
+
+def test_last_attempt_keeps_the_run_going_while_its_lease_lasts():
+    jobs = JobQueue(["a/p"])
+    for _ in range(2):
+        jobs.take()
+        jobs.requeue("a/p")
+    assert jobs.take() == "a/p"
+    assert not jobs.finished.is_set()
+    jobs.requeue("a/p")
+    assert jobs.finished.is_set()
+
+
+def test_late_result_after_an_expired_lease_is_used_once():
+    jobs = JobQueue(["a/p"])
+    jobs.take()
+    jobs.requeue("a/p")
+    jobs.take()
+    assert jobs.claim("a/p")
+    assert not jobs.claim("a/p")
+    jobs.complete("a/p")
+    jobs.requeue("a/p")
+    assert jobs.take() is None
+    assert jobs.finished.is_set()